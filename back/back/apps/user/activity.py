@@ -0,0 +1,94 @@
+"""
+Write-coalescing tracker of user activity.
+
+Requests only record the activity in memory, a background thread flushes
+the buffer every USER_ACTIVITY_FLUSH_INTERVAL seconds with one
+``UPDATE ... FROM (VALUES ...)`` statement per tracked column.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, connections
+from django.utils import timezone
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+TRACKED_FIELDS = ("last_seen", "last_login")
+
+_buffer = {field: {} for field in TRACKED_FIELDS}
+_lock = threading.Lock()
+_flusher_pid = None
+
+
+def record(user_id, *fields, when=None):
+    """Record that `user_id` was active now, by default as `last_seen`"""
+    if not settings.USER_ACTIVITY_ENABLED:
+        return
+    when = when or timezone.now()
+    with _lock:
+        for field in fields or ("last_seen",):
+            _buffer[field][user_id] = when
+    start_flusher()
+
+
+def flush():
+    """Write the buffered activity, returns the number of rows updated"""
+    global _buffer
+    with _lock:
+        buffer, _buffer = _buffer, {field: {} for field in TRACKED_FIELDS}
+
+    from .models import User
+
+    table = connection.ops.quote_name(User._meta.db_table)
+    updated = 0
+    for field, seen in buffer.items():
+        if not seen:
+            continue
+        column = connection.ops.quote_name(User._meta.get_field(field).column)
+        items = list(seen.items())
+        chunk_size = settings.USER_ACTIVITY_FLUSH_CHUNK_SIZE
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i : i + chunk_size]
+            values = ", ".join(["(%s::bigint, %s::timestamptz)"] * len(chunk))
+            params = [param for item in chunk for param in item]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} AS u SET {column} = v.seen "
+                    f"FROM (VALUES {values}) AS v(id, seen) "
+                    f"WHERE u.id = v.id AND (u.{column} IS NULL OR u.{column} < v.seen)",
+                    params,
+                )
+                updated += cursor.rowcount
+        if field == "last_login":
+            # part of the password reset tokens, drop the cached users
+            cache.invalidate_users(seen)
+    return updated
+
+
+def flush_forever():
+    event = threading.Event()
+    while not event.wait(settings.USER_ACTIVITY_FLUSH_INTERVAL):
+        try:
+            flush()
+        except Exception:
+            logger.exception("Could not flush the user activity")
+        finally:
+            connections.close_all()
+
+
+def start_flusher():
+    """Start the flusher thread once per process (workers are forked)"""
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=flush_forever, name="user-activity", daemon=True).start()
+    atexit.register(flush)
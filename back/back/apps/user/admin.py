@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.admin import DateFieldListFilter
 from django.utils.translation import gettext_lazy as _
-from .models import User
+from .models import User, MailOutbox
+from .search import search_users
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -27,8 +28,9 @@ class UserAdmin(BaseUserAdmin):
                 ),
             },
         ),
-        (_("Important dates"), {"fields": ("last_login", "date_joined")}),
+        (_("Important dates"), {"fields": ("last_login", "last_seen", "date_joined")}),
     )
+
     add_fieldsets = (
         (
             None,
@@ -44,3 +46,17 @@ class UserAdmin(BaseUserAdmin):
             },
         ),
     )
+
+    def get_search_results(self, request, queryset, search_term):
+        terms = search_term.split()
+        if not terms:
+            return queryset, False
+        return search_users(queryset, terms), False
+
+
+@admin.register(MailOutbox)
+class MailOutboxAdmin(admin.ModelAdmin):
+    list_display = ("email_key", "subject", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status", "email_key")
+    search_fields = ("subject",)
+    readonly_fields = ("created_at", "sent_at", "last_error")
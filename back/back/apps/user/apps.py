@@ -8,5 +8,5 @@ class UserConfig(AppConfig):
     verbose_name = _("user")
 
     def ready(self):
-        from . import signals
+        from . import schema, signals
         return super().ready()
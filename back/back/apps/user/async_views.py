@@ -0,0 +1,178 @@
+"""
+Async variants of the user endpoints, routed instead of the DRF views when
+USER_ASYNC_VIEWS is on (the `asgi` mode of docker-entrypoint.sh).
+
+They reuse the serializers and view logic of `views.py`, password hashing
+(the bulk of register and login) runs in the thread pool so a worker keeps
+serving other connections meanwhile.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import transaction
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenVerifySerializer
+
+from back.core.async_views import async_api_view, parse, render, run_in_thread
+from back.core.renderers import ORJSONRenderer
+
+from . import activity
+from .authentication import ClaimsJWTAuthentication, JWTAuthentication
+from .models import User
+from .serializers import (
+    OTPRequestSerializer,
+    RegisterUserSerializer,
+    UserTokenObtainPairSerializer,
+    UserTokenRefreshSerializer,
+)
+from .views import ProfileView, RegistrationView, SendOTPView, TokenObtainPairView
+
+AUTHENTICATION_CLASS = (
+    ClaimsJWTAuthentication if settings.USER_TOKEN_CLAIMS else JWTAuthentication
+)
+
+
+def get_drf_view(view_class, request):
+    """An instance of the DRF `view_class` set up for `request`"""
+    drf_request = Request(request)
+    drf_request.user = request.user
+    drf_request.accepted_renderer = ORJSONRenderer()
+    drf_request.accepted_media_type = ORJSONRenderer.media_type
+    return view_class(request=drf_request, args=(), kwargs={}, format_kwarg=None)
+
+
+@async_api_view(authentication_class=AUTHENTICATION_CLASS)
+async def profile(request):
+    """
+    Get data for current user
+    """
+    view = get_drf_view(ProfileView, request)
+    user = request.user
+    etag = view.get_etag([user])
+    if view.etag_matches("HTTP_IF_NONE_MATCH", etag):
+        return render(None, status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    data = await sync_to_async(view.get_retrieve_data)(user)
+    return render(data, headers={"ETag": etag})
+
+
+@async_api_view(methods=("POST",), authentication_class=AUTHENTICATION_CLASS)
+async def send_otp(request):
+    serializer = OTPRequestSerializer(data=parse(request))
+    serializer.is_valid(raise_exception=True)
+
+    view = get_drf_view(SendOTPView, request)
+    # the devices are locked (select_for_update) until the challenge is saved
+    data, status_code = await sync_to_async(transaction.atomic(view.send_challenge))(
+        request.user, serializer.data
+    )
+    return render(data, status=status_code)
+
+
+@transaction.atomic
+def create_user(user_data, password):
+    """`UserManager.create_user` with an already hashed password"""
+    user = User(password=password, **user_data)
+    user.username = User.normalize_username(user.username)
+    user.email = User.objects.normalize_email(user.email)
+    user.save()
+    RegistrationView().send_registration_email(user)
+    return user
+
+
+@async_api_view(
+    methods=("POST",),
+    throttle_scope=RegistrationView.throttle_scope,
+    throttle_classes=RegistrationView.throttle_classes,
+)
+async def register(request):
+    """
+    API for registering users, see `RegistrationView`
+    """
+    serializer = RegisterUserSerializer(data=parse(request))
+    # unique validators query the database
+    await sync_to_async(serializer.is_valid)(raise_exception=True)
+
+    user_data = serializer.get_user_data()
+    password = await run_in_thread(make_password, user_data.pop("password"))
+    await sync_to_async(create_user)(user_data, password)
+    return render(
+        {"message": RegistrationView.success_message},
+        status=status.HTTP_201_CREATED,
+    )
+
+
+def get_active_user(username):
+    try:
+        user = User._default_manager.get_cached_by_natural_key(username)
+    except User.DoesNotExist:
+        return None
+    if not user.is_active:
+        return None
+    if "password" in user.get_deferred_fields():
+        # not cached, loaded here rather than on access in the event loop
+        user.refresh_from_db(fields=["password"])
+    return user
+
+
+@async_api_view(
+    methods=("POST",),
+    throttle_scope=TokenObtainPairView.throttle_scope,
+    throttle_classes=TokenObtainPairView.throttle_classes,
+)
+async def token_obtain_pair(request):
+    """
+    Takes a set of user credentials and returns an access and refresh JSON web
+    token pair to prove the authentication of those credentials.
+    """
+    serializer = UserTokenObtainPairSerializer(data=parse(request))
+    # field validation only, authentication is split below
+    attrs = serializer.to_internal_value(serializer.initial_data)
+    password = attrs["password"]
+
+    user = await sync_to_async(get_active_user)(attrs[serializer.username_field])
+    if user is None:
+        # same cost as a wrong password, like ModelBackend
+        await run_in_thread(make_password, password)
+    elif not await run_in_thread(check_password, password, user.password):
+        user = None
+    if user is None:
+        raise exceptions.AuthenticationFailed(
+            serializer.error_messages["no_active_account"],
+            "no_active_account",
+        )
+
+    # the refresh token is recorded as outstanding
+    refresh = await sync_to_async(serializer.get_token)(user)
+    activity.record(user.pk, "last_login", "last_seen")
+    return render({"refresh": str(refresh), "access": str(refresh.access_token)})
+
+
+async def validate_token(serializer_class, request):
+    serializer = serializer_class(data=parse(request))
+    try:
+        # blacklist lookups and rotation query the database
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+    except TokenError as exc:
+        raise InvalidToken(exc.args[0])
+    return render(serializer.validated_data)
+
+
+@async_api_view(methods=("POST",))
+async def token_refresh(request):
+    """
+    Takes a refresh type JSON web token and returns an access type JSON web
+    token if the refresh token is valid.
+    """
+    return await validate_token(UserTokenRefreshSerializer, request)
+
+
+@async_api_view(methods=("POST",))
+async def token_verify(request):
+    """
+    Takes a token and indicates if it is valid.  This view provides no
+    information about a token's fitness for a particular use.
+    """
+    return await validate_token(TokenVerifySerializer, request)
@@ -0,0 +1,63 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from back.core.db_routers import check_sticky
+
+from . import activity
+from .cache import is_claims_revoked
+from .tokens import get_claims_user
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """
+    simplejwt's JWTAuthentication that loads the user through the cache
+    (see `managers.UserManager`), records the activity of the authenticated
+    user (see `back.apps.user.activity`) and keeps its reads on the primary
+    after its writes (see `back.core.db_routers`)
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            activity.record(result[0].pk)
+            # read from the primary for a while after this user wrote
+            check_sticky(result[0].pk)
+        return result
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = self.user_model._default_manager.get_cached(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication building the user from the claims of the access token
+    (see `back.apps.user.tokens`), without a query. Tokens without claims
+    fall back to loading the user. The claims of a user deactivated or
+    deleted since the token was issued are refused on a cache lookup (see
+    `cache.revoke_claims`).
+    """
+
+    def get_user(self, validated_token):
+        user = get_claims_user(validated_token)
+        if user is None:
+            return super().get_user(validated_token)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if is_claims_revoked(user.pk, user.version):
+            raise AuthenticationFailed(
+                _("User is inactive or deleted"), code="user_revoked"
+            )
+        return user
@@ -0,0 +1,155 @@
+"""
+Blacklist of the refresh tokens (simplejwt's token_blacklist app).
+
+Expired tokens are deleted by `manage.py prune_tokens`, they are rejected
+on their `exp` anyway, so both tables hold about REFRESH_TOKEN_LIFETIME of
+traffic.
+
+With TOKEN_BLACKLIST_FILTER each process keeps the blacklisted jtis in a
+Bloom filter, and tokens that are not in it skip the blacklist query. The
+filter loads the rows added since its last load at most every
+TOKEN_BLACKLIST_FILTER_INTERVAL seconds: a token blacklisted by another
+process may pass for that long. Tokens the process blacklists itself are
+added right away.
+
+`revoke_user_tokens` blacklists every token of a user at once ("log out
+everywhere"), access tokens stay valid until they expire
+(ACCESS_TOKEN_LIFETIME).
+"""
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+from back.core.bloom import BloomFilter
+
+
+class BlacklistFilter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.loaded_at = None
+        # rows are loaded from the last id seen TOKEN_BLACKLIST_FILTER_OVERLAP
+        # seconds ago, ids are taken before their transaction commits so rows
+        # can show up after greater ids
+        self.since_id = 0
+        self.history = deque()
+
+    def get_bloom(self):
+        """A Bloom filter big enough for the current blacklist"""
+        capacity = max(
+            settings.TOKEN_BLACKLIST_FILTER_CAPACITY,
+            2 * BlacklistedToken.objects.count(),
+        )
+        return BloomFilter(capacity, settings.TOKEN_BLACKLIST_FILTER_ERROR_RATE)
+
+    def build(self, now):
+        """A filter of the whole blacklist, without the pruned tokens"""
+        bloom = self.get_bloom()
+        # the next loads start from the last row blacklisted before the
+        # overlap, the rows of smaller ids were taken before it and committed
+        horizon = timezone.now() - timedelta(
+            seconds=settings.TOKEN_BLACKLIST_FILTER_OVERLAP
+        )
+        since_id = last_id = 0
+        rows = BlacklistedToken.objects.values_list(
+            "id", "token__jti", "blacklisted_at"
+        )
+        for row_id, jti, blacklisted_at in rows.iterator():
+            bloom.add(jti)
+            last_id = max(last_id, row_id)
+            if blacklisted_at <= horizon:
+                since_id = max(since_id, row_id)
+        return bloom, since_id, deque([(now, last_id)])
+
+    def load(self, now):
+        if self.bloom is None or self.bloom.is_full:
+            self.bloom, self.since_id, self.history = self.build(now)
+            self.loaded_at = now
+            return
+
+        bloom, since_id, history = self.bloom, self.since_id, self.history
+        horizon = now - settings.TOKEN_BLACKLIST_FILTER_OVERLAP
+        while history and history[0][0] <= horizon:
+            since_id = history.popleft()[1]
+
+        last_id = history[-1][1] if history else since_id
+        rows = BlacklistedToken.objects.filter(id__gt=since_id).values_list(
+            "id", "token__jti"
+        )
+        for row_id, jti in rows.iterator():
+            bloom.add(jti)
+            last_id = max(last_id, row_id)
+        history.append((now, last_id))
+
+        self.bloom, self.since_id, self.history = bloom, since_id, history
+        self.loaded_at = now
+
+    def __contains__(self, jti):
+        now = time.monotonic()
+        if self.is_stale(now):
+            with self.lock:
+                if self.is_stale(now):
+                    self.load(now)
+        return jti in self.bloom
+
+    def is_stale(self, now):
+        return (
+            self.loaded_at is None
+            or now - self.loaded_at >= settings.TOKEN_BLACKLIST_FILTER_INTERVAL
+        )
+
+    def add(self, jti):
+        bloom = self.bloom
+        if bloom is not None:
+            bloom.add(jti)
+
+    def expire(self):
+        """Load the new rows on the next check"""
+        self.loaded_at = None
+
+
+blacklist_filter = BlacklistFilter()
+
+
+def is_blacklisted(jti):
+    if settings.TOKEN_BLACKLIST_FILTER and jti not in blacklist_filter:
+        return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def blacklisted(jti):
+    """Record that the current process blacklisted `jti`"""
+    if settings.TOKEN_BLACKLIST_FILTER:
+        blacklist_filter.add(jti)
+
+
+def revoke_user_tokens(user_id):
+    """
+    Blacklist all the unexpired refresh tokens of `user_id` with a single
+    ``INSERT ... SELECT``, returns the number of tokens blacklisted
+    """
+    now = timezone.now()
+    quote_name = connection.ops.quote_name
+    blacklist_table = quote_name(BlacklistedToken._meta.db_table)
+    outstanding_table = quote_name(OutstandingToken._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {blacklist_table} (token_id, blacklisted_at) "
+            f"SELECT o.id, %s FROM {outstanding_table} AS o "
+            f"WHERE o.user_id = %s AND o.expires_at > %s "
+            f"ON CONFLICT (token_id) DO NOTHING",
+            [now, user_id, now],
+        )
+        revoked = cursor.rowcount
+    if settings.TOKEN_BLACKLIST_FILTER:
+        blacklist_filter.expire()
+    return revoked
@@ -0,0 +1,154 @@
+"""
+Bulk changes of users (`UserViewSet` bulk actions).
+
+The payload is validated once, rows are written with a single statement per
+chunk (`UPDATE ... WHERE id IN (...)`, `INSERT` of many rows) and side
+effects run per chunk through the `users_bulk_changed` signal, since
+`save()` and `post_save` are bypassed. The many to many relations are
+written to their through tables, `m2m_changed` is not sent either.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import EmailDevice, User
+from .signals import users_bulk_changed
+
+
+def chunked(items, size=None):
+    size = size or settings.USER_BULK_CHUNK_SIZE
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def set_many_to_many(name, user_ids, objs):
+    """
+    Replace the `name` relation of every user in `user_ids` by `objs`,
+    without `m2m_changed` (see `users_bulk_changed`)
+    """
+    field = User._meta.get_field(name)
+    through = field.remote_field.through
+    source = f"{field.m2m_field_name()}_id"
+    target = f"{field.m2m_reverse_field_name()}_id"
+
+    through.objects.filter(**{f"{source}__in": user_ids}).delete()
+    through.objects.bulk_create(
+        [
+            through(**{source: user_id, target: obj.pk})
+            for user_id in user_ids
+            for obj in objs
+        ]
+    )
+
+
+def update_users(user_ids, data):
+    """
+    Apply the validated `data` to the users `user_ids`, their `version` is
+    bumped so ETags and cached profiles of the old state are dropped.
+    """
+    data = dict(data)
+    many_to_many = {
+        field.name: data.pop(field.name)
+        for field in User._meta.many_to_many
+        if field.name in data
+    }
+    fields = [*data, *many_to_many]
+
+    with transaction.atomic():
+        for chunk in chunked(user_ids):
+            User.objects.filter(pk__in=chunk).update(
+                **data, version=F("version") + 1
+            )
+            for name, objs in many_to_many.items():
+                set_many_to_many(name, chunk, objs)
+            users_bulk_changed.send(
+                sender=User, user_ids=chunk, fields=fields, created=False
+            )
+    return len(user_ids)
+
+
+def get_unique_conflicts(rows, fields=("username", "email")):
+    """
+    Per row errors for unique `fields` already taken, by another row of
+    `rows` or in the database (one query per field).
+    """
+    errors = {}
+    for name in fields:
+        message = User._meta.get_field(name).error_messages["unique"]
+        values = [data[name] for _, data in rows if name in data]
+        taken = set(
+            User._default_manager.filter(**{f"{name}__in": values}).values_list(
+                name, flat=True
+            )
+        )
+        for index, data in rows:
+            value = data.get(name)
+            if value is None:
+                continue
+            if value in taken:
+                errors.setdefault(index, {})[name] = [message]
+            taken.add(value)
+    return errors
+
+
+def insert_users(rows):
+    """
+    Insert the `(index, user)` of `rows`, skipping the ones whose username
+    or email was taken since `get_unique_conflicts` (by a concurrent
+    request). Return the inserted rows and the errors of the others.
+    """
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create([user for _, user in rows])
+        return rows, {}
+    except IntegrityError:
+        pass
+
+    errors = get_unique_conflicts(
+        [
+            (index, {"username": user.username, "email": user.email})
+            for index, user in rows
+        ]
+    )
+    rows = [(index, user) for index, user in rows if index not in errors]
+    User.objects.bulk_create([user for _, user in rows])
+    return rows, errors
+
+
+def create_users(rows):
+    """
+    Create a user (and its email device) for each validated `(index, data)`
+    row, a row without password gets an unusable one. Return the created
+    `(index, user)` rows and the errors of the conflicting ones by index.
+    """
+    users = []
+    for index, data in rows:
+        data = dict(data)
+        password = data.pop("password", None)
+        user = User(**data)
+        user.set_password(password)
+        users.append((index, user))
+
+    created, errors = [], {}
+    with transaction.atomic():
+        for chunk in chunked(users):
+            chunk, conflicts = insert_users(chunk)
+            errors.update(conflicts)
+            EmailDevice.objects.bulk_create(
+                [
+                    EmailDevice(
+                        user=user,
+                        name=f"personal device for user {user.pk}",
+                        confirmed=True,
+                    )
+                    for _, user in chunk
+                ]
+            )
+            users_bulk_changed.send(
+                sender=User,
+                user_ids=[user.pk for _, user in chunk],
+                fields=None,
+                created=True,
+            )
+            created += chunk
+    return created, errors
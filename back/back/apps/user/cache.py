@@ -0,0 +1,135 @@
+"""
+Caches of the user app.
+
+Rendered profiles (`ProfileView`): one entry per user holds the serialized
+data of every requested variant (the fields `?fields=` / `?omit=` leave)
+together with the user version it was built from, so a stale entry is never served even if an
+invalidation is missed.
+
+Single user lookups (`managers.UserManager`): the fields of the user by pk
+(not its password hash), and the pk(s) by username and by email, misses
+included, all read from the primary. They are dropped when a user is saved
+or deleted (see `signals`), the lookups by username and email check the
+user they get and fall back to the database when it changed since.
+
+Revoked claims (`authentication.ClaimsJWTAuthentication`): the version of a
+user deactivated or deleted, the access tokens claiming it or an older one
+are refused for as long as they may live (ACCESS_TOKEN_LIFETIME).
+"""
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework_simplejwt.settings import api_settings
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[settings.PROFILE_CACHE_ALIAS]
+
+
+def get_user_key(field, value):
+    if field == "email":
+        # like `__iexact`, UPPER() in PostgreSQL
+        value = value.upper()
+    return f"user:{field}:{value}"
+
+
+def get_profile_key(user_id):
+    return f"user:profile:{user_id}"
+
+
+def count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_stats():
+    """Hit/miss counters of the current process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_profile(user, variant):
+    entry = get_cache().get(get_profile_key(user.pk))
+    if entry and entry["version"] == user.version and variant in entry["data"]:
+        count("hits")
+        return entry["data"][variant]
+    count("misses")
+    return None
+
+
+def set_profile(user, variant, data):
+    cache = get_cache()
+    key = get_profile_key(user.pk)
+    entry = cache.get(key)
+    if not entry or entry["version"] != user.version:
+        entry = {"version": user.version, "data": {}}
+    entry["data"][variant] = data
+    cache.set(key, entry, settings.PROFILE_CACHE_TIMEOUT)
+
+
+def invalidate_profiles(*user_ids):
+    get_cache().delete_many([get_profile_key(user_id) for user_id in user_ids])
+    count("invalidations")
+
+
+_absent = object()
+
+
+def get_or_load(key, load):
+    """
+    The cached value of `key`, `load()` cached on a miss. Empty values (None,
+    []) are cached too, for USER_CACHE_MISS_TIMEOUT.
+    """
+    cache = get_cache()
+    value = cache.get(key, _absent)
+    if value is not _absent:
+        count("user_hits")
+        return value
+
+    count("user_misses")
+    value = load()
+    timeout = settings.USER_CACHE_TIMEOUT if value else settings.USER_CACHE_MISS_TIMEOUT
+    if timeout:
+        cache.set(key, value, timeout)
+    return value
+
+
+def invalidate_users(user_ids=(), usernames=(), emails=()):
+    keys = [
+        *(get_user_key("pk", user_id) for user_id in user_ids),
+        *(get_user_key("username", username) for username in usernames),
+        *(get_user_key("email", email) for email in emails if email),
+    ]
+    cache = get_cache()
+    cache.delete_many(keys)
+    # and once committed, a concurrent request may have cached the old row
+    transaction.on_commit(lambda: cache.delete_many(keys))
+    count("user_invalidations")
+
+
+def invalidate_user(user, *old_emails):
+    invalidate_users([user.pk], [user.get_username()], [user.email, *old_emails])
+
+
+def get_claims_key(user_id):
+    return f"user:claims:{user_id}"
+
+
+def revoke_claims(versions):
+    """Refuse the access tokens claiming `{user_id: version}` or older"""
+    timeout = int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+    get_cache().set_many(
+        {get_claims_key(user_id): version for user_id, version in versions.items()},
+        timeout,
+    )
+
+
+def is_claims_revoked(user_id, version):
+    revoked = get_cache().get(get_claims_key(user_id))
+    return revoked is not None and version <= revoked
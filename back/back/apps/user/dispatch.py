@@ -0,0 +1,61 @@
+"""
+Side effects of the user app (mails, notifications, ...) that must only run
+once the database work that triggered them is committed.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.USER_SIDE_EFFECTS_WORKERS,
+                thread_name_prefix="user-side-effects",
+            )
+    return _executor
+
+
+def run(func, *args, **kwargs):
+    """Run a side effect, errors are logged instead of raised"""
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Side effect %r failed", func)
+
+
+def run_in_background(task):
+    try:
+        task()
+    finally:
+        # pool threads must not keep their own connections open
+        connections.close_all()
+
+
+def on_commit(func, *args, background=False, using=None, **kwargs):
+    """
+    Register `func(*args, **kwargs)` to run after the current transaction
+    commits, it never runs if the transaction is rolled back. Outside of a
+    transaction it runs right away.
+
+    With `background` the call is handed to a thread pool so the response
+    is not delayed by it (unless USER_SIDE_EFFECTS_ASYNC is off).
+    """
+    task = partial(run, func, *args, **kwargs)
+    if background and settings.USER_SIDE_EFFECTS_ASYNC:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_in_background, task), using=using
+        )
+    else:
+        transaction.on_commit(task, using=using)
@@ -1,3 +1,12 @@
+import threading
+import time
+
+import html2text
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.template import Context, Template, loader
+from premailer import transform
+
 from simple_mail.mailer import BaseSimpleMail, simple_mailer
 
 
@@ -10,10 +19,130 @@ class EMAIL_TYPES:
     CHANGE_USER = "change user"
 
 
+class CompiledMail:
+    """
+    The templates of a SimpleMail row parsed once, rendering only does the
+    context substitution (same output as ``SimpleMail.render``).
+    """
+
+    def __init__(self, mail, config_context, template_name):
+        self.config_context = config_context
+        self.banner_url = mail.banner_url
+        self.subject = Template(
+            "{%% autoescape off %%}%s{%% endautoescape %%}" % mail.subject
+        )
+        self.title = Template(mail.title)
+        self.footer_content = Template(config_context.get("footer_content") or "")
+        self.button_label = Template(mail.button_label)
+        self.button_link = Template(mail.button_link)
+        self.body = Template(mail.body)
+        self.template = loader.get_template(template_name)
+        self.expires = time.monotonic() + settings.SIMPLE_MAIL_TEMPLATE_CACHE_TIMEOUT
+
+    def render(self, context):
+        ctx = Context(context)
+        data = {**self.config_context, "banner_url": self.banner_url, **context}
+        data.update(
+            {
+                "title": self.title.render(ctx),
+                "subject": self.subject.render(ctx),
+                "footer_content": self.footer_content.render(ctx),
+                "button_label": self.button_label.render(ctx),
+                "button_link": self.button_link.render(ctx),
+                "body": self.body.render(ctx),
+            }
+        )
+        html = transform(self.template.render(data))
+        h = html2text.HTML2Text()
+        h.ignore_images = True
+        h.ignore_tables = True
+        return {
+            "subject": data["subject"],
+            "message": h.handle(html),
+            "html_message": html,
+        }
+
+
+_compiled_mails = {}
+_compiled_mails_lock = threading.Lock()
+
+
+def get_compiled_mail(email_key, template_name=None):
+    """
+    Return the cached `CompiledMail` of `email_key`, entries are dropped when
+    the mail or the mail config is saved and expire after
+    SIMPLE_MAIL_TEMPLATE_CACHE_TIMEOUT seconds so other processes catch up.
+    """
+    from simple_mail.models import SimpleMail, SimpleMailConfig
+
+    if template_name is None:
+        template_name = getattr(
+            settings, "SIMPLE_MAIL_DEFAULT_TEMPLATE", "simple_mail/default.html"
+        )
+    key = (email_key, template_name)
+    compiled = _compiled_mails.get(key)
+    if compiled is None or compiled.expires < time.monotonic():
+        mail = SimpleMail.objects.get(key=email_key)
+        config_context = SimpleMailConfig.get_singleton().context
+        compiled = CompiledMail(mail, config_context, template_name)
+        with _compiled_mails_lock:
+            _compiled_mails[key] = compiled
+    return compiled
+
+
+def clear_compiled_mails(email_key=None):
+    with _compiled_mails_lock:
+        if email_key is None:
+            _compiled_mails.clear()
+            return
+        for key in [key for key in _compiled_mails if key[0] == email_key]:
+            del _compiled_mails[key]
+
+
 class BaseSimpleMail(BaseSimpleMail):
     def set_context(self, ctx={}):
         self.context = {**self.context, **ctx}
 
+    def render(self):
+        return get_compiled_mail(self.email_key, self.template).render(self.context)
+
+    def send(self, to, from_email=None, **kwargs):
+        """
+        Render the mail and write it to the outbox, the ``send_outbox``
+        worker delivers it once the current transaction commits.
+
+        Mails with extra options (attachments, headers, ...) or with the
+        outbox disabled are sent from a background thread after commit.
+        """
+        from . import dispatch
+
+        rendered = self.render()
+
+        if kwargs or not settings.MAIL_OUTBOX_ENABLED:
+            fail_silently = kwargs.pop("fail_silently", False)
+            message = EmailMultiAlternatives(
+                subject=rendered["subject"],
+                body=rendered["message"],
+                from_email=from_email,
+                to=to,
+                **kwargs,
+            )
+            message.attach_alternative(rendered["html_message"], "text/html")
+            dispatch.on_commit(message.send, fail_silently=fail_silently, background=True)
+            return 1
+
+        from .models import MailOutbox
+
+        MailOutbox.objects.create(
+            email_key=self.email_key,
+            to=list(to),
+            from_email=from_email or "",
+            subject=rendered["subject"],
+            body=rendered["message"],
+            html_message=rendered["html_message"],
+        )
+        return 1
+
 
 class WelcomeMail(BaseSimpleMail):
     email_key = EMAIL_TYPES.WELCOME
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from back.core.schema import build_schema
+
+
+class Command(BaseCommand):
+    help = "Generate the OpenAPI schema files served at docs/schema/"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--root",
+            default=settings.SCHEMA_ROOT,
+            help="Directory where the schema files are written",
+        )
+
+    def handle(self, *args, **options):
+        manifest = build_schema(options["root"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Schema {manifest['version']} built "
+                f"({', '.join(manifest['encodings'])})"
+            )
+        )
@@ -0,0 +1,75 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+
+class Command(BaseCommand):
+    help = "Delete the expired refresh tokens, blacklisted or not"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=settings.TOKEN_PRUNE_CHUNK_SIZE,
+            help="Number of tokens deleted by each transaction",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="Seconds to wait between chunks, to go easy on the database",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Prune again every INTERVAL seconds instead of exiting",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.prune(options["chunk_size"], options["pause"])
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
+
+    def prune(self, chunk_size, pause):
+        now = timezone.now()
+        outstanding = blacklisted = 0
+        while True:
+            deleted = self.prune_chunk(now, chunk_size)
+            if not deleted:
+                break
+            outstanding += deleted.get(OutstandingToken._meta.label, 0)
+            blacklisted += deleted.get(BlacklistedToken._meta.label, 0)
+            time.sleep(pause)
+
+        self.stdout.write(
+            f"Deleted {outstanding} expired tokens ({blacklisted} blacklisted)"
+        )
+
+    def prune_chunk(self, now, chunk_size):
+        """
+        Delete a chunk of expired tokens in a short transaction.
+
+        Tokens are taken in id order, which is about their expiration order,
+        and locked with SKIP LOCKED so the tokens being blacklisted are left
+        for the next run instead of waited for.
+        """
+        with transaction.atomic():
+            ids = list(
+                OutstandingToken.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by("id")
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if not ids:
+                return {}
+            # the blacklisting goes with its token (CASCADE)
+            return OutstandingToken.objects.filter(id__in=ids).delete()[1]
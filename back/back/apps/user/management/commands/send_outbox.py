@@ -0,0 +1,137 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from back.apps.user.models import MailOutbox
+
+
+class Command(BaseCommand):
+    help = "Deliver the mails waiting in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.MAIL_OUTBOX_BATCH_SIZE,
+            help="Number of mails claimed on each round",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the outbox and exit instead of polling forever",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pruned_at = None
+        while True:
+            processed = self.drain(batch_size)
+            if processed:
+                continue
+            # idle, delete the old sent mails now and then
+            now = time.monotonic()
+            interval = settings.MAIL_OUTBOX_PRUNE_INTERVAL
+            if pruned_at is None or now - pruned_at >= interval:
+                self.prune_sent()
+                pruned_at = now
+            if options["once"]:
+                break
+            time.sleep(settings.MAIL_OUTBOX_POLL_INTERVAL)
+
+    def get_retry_time(self, attempts):
+        """Exponential backoff, capped to one day"""
+        delay = settings.MAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+        return timezone.now() + timedelta(seconds=min(delay, 24 * 60 * 60))
+
+    def claim(self, batch_size):
+        """
+        Claim a batch of due mails in a short transaction.
+
+        Rows are locked with SKIP LOCKED so any number of workers can drain
+        the outbox concurrently, and claimed by pushing their next attempt
+        MAIL_OUTBOX_CLAIM_TIMEOUT seconds away: the other workers skip them
+        while they are sent, and they are due again if this one dies.
+        """
+        with transaction.atomic():
+            mails = list(
+                MailOutbox.objects.select_for_update(skip_locked=True)
+                .filter(
+                    status=MailOutbox.STATUS.PENDING,
+                    next_attempt_at__lte=timezone.now(),
+                )
+                .order_by("next_attempt_at")[:batch_size]
+            )
+            if mails:
+                MailOutbox.objects.filter(pk__in=[mail.pk for mail in mails]).update(
+                    next_attempt_at=timezone.now()
+                    + timedelta(seconds=settings.MAIL_OUTBOX_CLAIM_TIMEOUT)
+                )
+        return mails
+
+    def drain(self, batch_size):
+        """
+        Claim a batch of due mails and send them over a single connection,
+        outside of any transaction, then record each result
+        """
+        mails = self.claim(batch_size)
+        if not mails:
+            return 0
+
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            for mail in mails:
+                self.fail(mail, e)
+            return len(mails)
+
+        try:
+            for mail in mails:
+                try:
+                    connection.send_messages([mail.get_email_message(connection)])
+                except Exception as e:
+                    self.fail(mail, e)
+                else:
+                    mail.status = MailOutbox.STATUS.SENT
+                    mail.sent_at = timezone.now()
+                    mail.attempts += 1
+                    mail.save(update_fields=["status", "sent_at", "attempts"])
+        finally:
+            connection.close()
+
+        self.stdout.write(f"Processed {len(mails)} mails")
+        return len(mails)
+
+    def fail(self, mail, error):
+        mail.attempts += 1
+        mail.last_error = str(error)
+        if mail.attempts >= settings.MAIL_OUTBOX_MAX_ATTEMPTS:
+            mail.status = MailOutbox.STATUS.FAILED
+        else:
+            mail.next_attempt_at = self.get_retry_time(mail.attempts)
+        mail.save(update_fields=["attempts", "last_error", "status", "next_attempt_at"])
+        self.stderr.write(f"Failed to send {mail.pk}: {error}")
+
+    def prune_sent(self, chunk_size=1000):
+        """
+        Delete the mails sent more than MAIL_OUTBOX_KEEP_SENT_DAYS ago, by
+        chunks, the failed ones are kept for inspection
+        """
+        keep = timedelta(days=settings.MAIL_OUTBOX_KEEP_SENT_DAYS)
+        old = MailOutbox.objects.filter(
+            status=MailOutbox.STATUS.SENT, sent_at__lt=timezone.now() - keep
+        )
+        deleted = 0
+        while True:
+            ids = list(old.values_list("pk", flat=True)[:chunk_size])
+            if not ids:
+                break
+            deleted += MailOutbox.objects.filter(pk__in=ids).delete()[0]
+        if deleted:
+            self.stdout.write(f"Deleted {deleted} sent mails")
+        return deleted
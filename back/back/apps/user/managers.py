@@ -0,0 +1,99 @@
+from django.contrib.auth import models as auth_models
+from django.db import DEFAULT_DB_ALIAS
+
+from . import cache
+
+
+class UserManager(auth_models.UserManager):
+    """
+    UserManager with cached single user lookups (see `back.apps.user.cache`)
+    for the authentication paths, each hit saves a query on the user table.
+
+    The lookups read the primary, a replica lagging behind would cache an
+    old row. The cache holds the fields of the user but its password hash,
+    the users it gives load the password on access (`check_password`, the
+    password reset tokens).
+    """
+
+    # the fields of the user left out of the cache
+    uncached_fields = ("password",)
+
+    def get_primary(self):
+        return self.db_manager(DEFAULT_DB_ALIAS)
+
+    def get_cached_fields(self):
+        return [
+            field.attname
+            for field in self.model._meta.concrete_fields
+            if field.attname not in self.uncached_fields
+        ]
+
+    def from_cached(self, values):
+        """The user of the cached `values`, the missing fields deferred"""
+        field_names = [
+            field.attname
+            for field in self.model._meta.concrete_fields
+            if field.attname in values
+        ]
+        return self.model.from_db(
+            DEFAULT_DB_ALIAS, field_names, [values[name] for name in field_names]
+        )
+
+    def get_cached(self, pk):
+        """The user `pk`, None if there is none"""
+        values = cache.get_or_load(
+            cache.get_user_key("pk", pk),
+            lambda: self.get_primary()
+            .filter(pk=pk)
+            .values(*self.get_cached_fields())
+            .first(),
+        )
+        return None if values is None else self.from_cached(values)
+
+    def get_cached_by_natural_key(self, username):
+        """`get_by_natural_key` through the cache"""
+        pk = cache.get_or_load(
+            cache.get_user_key("username", username),
+            lambda: self.get_primary()
+            .filter(**{self.model.USERNAME_FIELD: username})
+            .values_list("pk", flat=True)
+            .first(),
+        )
+        if pk is None:
+            raise self.model.DoesNotExist(
+                f"{self.model._meta.object_name} matching query does not exist."
+            )
+
+        user = self.get_cached(pk)
+        if user is None or user.get_username() != username:
+            # renamed since
+            cache.invalidate_users(usernames=[username])
+            return self.get_primary().get_by_natural_key(username)
+        return user
+
+    def filter_cached_by_email(self, email):
+        """
+        The active users whose email is `email` case insensitively, through
+        the cache
+        """
+        email_field_name = self.model.get_email_field_name()
+        # the lookup of the partial index on UPPER(email) WHERE is_active
+        lookup = {f"{email_field_name}__iexact": email, "is_active": True}
+        pks = cache.get_or_load(
+            cache.get_user_key("email", email),
+            lambda: list(
+                self.get_primary().filter(**lookup).values_list("pk", flat=True)
+            ),
+        )
+
+        users = [self.get_cached(pk) for pk in pks]
+        if any(
+            user is None
+            or not user.is_active
+            or getattr(user, email_field_name).upper() != email.upper()
+            for user in users
+        ):
+            # email changed since, or deactivated
+            cache.invalidate_users(emails=[email])
+            return list(self.get_primary().filter(**lookup))
+        return users
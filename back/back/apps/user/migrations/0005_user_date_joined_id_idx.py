@@ -0,0 +1,21 @@
+# Generated by Django 4.0.1 on 2026-10-18 05:50
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY does not lock writes but can not run in a
+    # transaction
+    atomic = False
+
+    dependencies = [
+        ('user', '0004_user_last_seen'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['date_joined', 'id'], name='user_date_joined_id_idx'),
+        ),
+    ]
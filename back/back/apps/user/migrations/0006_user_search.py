@@ -0,0 +1,99 @@
+# Generated by Django 4.0.1 on 2026-10-18 05:51
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+import django.contrib.postgres.search
+from django.db import migrations, transaction
+import django.db.models.functions.text
+
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('simple', coalesce({row}.username, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce({row}.document_id, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce({row}.first_name, '') || ' ' || coalesce({row}.last_name, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(split_part({row}.email, '@', 1), '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce({row}.email, '')), 'C')
+"""
+
+CREATE_TRIGGER = f"""
+CREATE FUNCTION user_user_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(row="NEW")};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_user_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF username, document_id, first_name, last_name, email, search_vector
+    ON user_user
+    FOR EACH ROW EXECUTE FUNCTION user_user_search_vector_update();
+"""
+
+# the trigger computes the vector of every updated row
+BACKFILL = """
+WITH batch AS (
+    SELECT id FROM user_user WHERE id > %s ORDER BY id LIMIT %s
+)
+UPDATE user_user SET search_vector = NULL FROM batch WHERE user_user.id = batch.id
+RETURNING user_user.id
+"""
+
+BACKFILL_BATCH_SIZE = 5000
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS user_user_search_vector_trigger ON user_user;
+DROP FUNCTION IF EXISTS user_user_search_vector_update();
+"""
+
+
+def backfill_search_vector(apps, schema_editor):
+    """
+    Fill the search vector of the existing users by batches of ids, each in
+    its own short transaction, instead of one UPDATE locking the whole table
+    """
+    connection = schema_editor.connection
+    last_id = 0
+    while True:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(BACKFILL, [last_id, BACKFILL_BATCH_SIZE])
+            ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            break
+        last_id = max(ids)
+
+
+class Migration(migrations.Migration):
+    # the backfill commits by batches and CREATE INDEX CONCURRENTLY does not
+    # lock writes, neither can run in a single transaction
+    atomic = False
+
+    dependencies = [
+        ('user', '0005_user_date_joined_id_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='user',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='user_search_vector_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('username'), name='gin_trgm_ops'), name='user_username_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='gin_trgm_ops'), name='user_email_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('document_id'), name='gin_trgm_ops'), name='user_document_id_trgm_idx'),
+        ),
+    ]
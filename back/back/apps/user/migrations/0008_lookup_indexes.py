@@ -0,0 +1,30 @@
+# Generated by Django 4.0.1 on 2026-10-18 06:05
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY does not lock writes but can not run in a
+    # transaction
+    atomic = False
+
+    dependencies = [
+        ('user', '0007_user_version'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Upper('email'), condition=models.Q(('is_active', True)), name='user_active_email_upper_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_active', False)), fields=['date_joined', 'id'], name='user_inactive_date_joined_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['document_id'], name='user_document_id_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.0.1 on 2026-10-18 06:10
+
+import back.apps.user.managers
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', back.apps.user.managers.UserManager()),
+            ],
+        ),
+    ]
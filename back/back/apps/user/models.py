@@ -1,12 +1,19 @@
 from django.core import validators
-from django.db import models
+from django.core.mail import EmailMultiAlternatives
+from django.db import connections, models
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Upper
+from django.db.models.sql import UpdateQuery
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from django_otp.plugins.otp_email.models import EmailDevice as BaseEmailDevice
 
 from back.apps.user.mails import SendOTPMail
+from back.apps.user.managers import UserManager
 
 
 class User(AbstractUser):
@@ -29,6 +36,85 @@ class User(AbstractUser):
         ],
     )
 
+    last_seen = models.DateTimeField(_("last seen"), blank=True, null=True)
+
+    # maintained by a trigger, see back.apps.user.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # bumped on every save, used for ETags and cache keys
+    version = models.PositiveIntegerField(_("version"), default=1, editable=False)
+
+    objects = UserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # keyset pagination of the users list
+            models.Index(fields=["date_joined", "id"], name="user_date_joined_id_idx"),
+            # search
+            GinIndex(fields=["search_vector"], name="user_search_vector_idx"),
+            GinIndex(
+                OpClass(Upper("username"), name="gin_trgm_ops"),
+                name="user_username_trgm_idx",
+            ),
+            GinIndex(
+                OpClass(Upper("email"), name="gin_trgm_ops"),
+                name="user_email_trgm_idx",
+            ),
+            GinIndex(
+                OpClass(Upper("document_id"), name="gin_trgm_ops"),
+                name="user_document_id_trgm_idx",
+            ),
+            # case insensitive email lookups (`__iexact`) of the password
+            # reset, only active users can reset their password. The login
+            # matches the username exactly, on its unique index
+            models.Index(
+                Upper("email"),
+                condition=models.Q(is_active=True),
+                name="user_active_email_upper_idx",
+            ),
+            # the few deactivated users, in the users list order
+            models.Index(
+                fields=["date_joined", "id"],
+                condition=models.Q(is_active=False),
+                name="user_inactive_date_joined_idx",
+            ),
+            models.Index(fields=["document_id"], name="user_document_id_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        adding, version = self._state.adding, self.version
+        if not adding:
+            # bumped by the UPDATE, concurrent saves of the same user each
+            # count, read back by `_do_update`
+            self.version = models.F("version") + 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "version" not in update_fields:
+            kwargs["update_fields"] = [*update_fields, "version"]
+        try:
+            super().save(*args, **kwargs)
+        except BaseException:
+            self.version = version
+            raise
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        """
+        The UPDATE of `save`, returning the bumped `version` so it is set
+        before post_save is sent, in the same statement.
+        """
+        query = base_qs.filter(pk=pk_val).query.chain(UpdateQuery)
+        query.add_update_fields(values)
+        sql, params = query.get_compiler(using).as_sql()
+        column = connections[using].ops.quote_name(
+            self._meta.get_field("version").column
+        )
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"{sql} RETURNING {column}", params)
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        self.version = row[0]
+        return True
+
     def get_full_name(self):
         # Returns the first_name and the last_name
         return f"{self.first_name} {self.last_name}"
@@ -90,3 +176,68 @@ class EmailDevice(BaseEmailDevice):
         message = _("sent by email")
 
         return message
+
+
+class MailOutbox(models.Model):
+    """
+    A rendered email waiting to be delivered by the ``send_outbox`` worker.
+
+    Rows are written inside the same transaction as the request that
+    produced them, so a rolled back request never sends anything and the
+    SMTP round trip happens outside of the request.
+    """
+
+    class STATUS:
+        PENDING = "pending"
+        SENT = "sent"
+        FAILED = "failed"
+
+        CHOICES = (
+            (PENDING, _("pending")),
+            (SENT, _("sent")),
+            (FAILED, _("failed")),
+        )
+
+    email_key = models.CharField(_("email key"), max_length=100, blank=True)
+    to = models.JSONField(_("to"), default=list)
+    from_email = models.CharField(_("from email"), max_length=254, blank=True)
+    subject = models.CharField(_("subject"), max_length=255)
+    body = models.TextField(_("body"), blank=True)
+    html_message = models.TextField(_("html message"), blank=True)
+    status = models.CharField(
+        _("status"),
+        max_length=10,
+        choices=STATUS.CHOICES,
+        default=STATUS.PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(_("attempts"), default=0)
+    last_error = models.TextField(_("last error"), blank=True)
+    next_attempt_at = models.DateTimeField(_("next attempt at"), default=timezone.now)
+    created_at = models.DateTimeField(_("created at"), auto_now_add=True)
+    sent_at = models.DateTimeField(_("sent at"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("outbox mail")
+        verbose_name_plural = _("outbox mails")
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                name="user_outbox_pending_idx",
+                condition=models.Q(status="pending"),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.email_key or self.subject} -> {', '.join(self.to)}"
+
+    def get_email_message(self, connection=None):
+        message = EmailMultiAlternatives(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email or None,
+            to=self.to,
+            connection=connection,
+        )
+        if self.html_message:
+            message.attach_alternative(self.html_message, "text/html")
+        return message
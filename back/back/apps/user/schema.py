@@ -0,0 +1,24 @@
+"""
+OpenAPI extensions (drf-spectacular) of the local subclasses of simplejwt's
+authentication and serializers: the ones shipped with drf-spectacular
+match simplejwt's own classes only.
+"""
+from drf_spectacular.contrib.rest_framework_simplejwt import (
+    SimpleJWTScheme,
+    TokenObtainPairSerializerExtension,
+    TokenRefreshSerializerExtension,
+)
+
+
+class JWTScheme(SimpleJWTScheme):
+    # ClaimsJWTAuthentication too
+    target_class = "back.apps.user.authentication.JWTAuthentication"
+    match_subclasses = True
+
+
+class UserTokenObtainPairSerializerExtension(TokenObtainPairSerializerExtension):
+    target_class = "back.apps.user.serializers.UserTokenObtainPairSerializer"
+
+
+class UserTokenRefreshSerializerExtension(TokenRefreshSerializerExtension):
+    target_class = "back.apps.user.serializers.UserTokenRefreshSerializer"
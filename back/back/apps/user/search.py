@@ -0,0 +1,76 @@
+"""
+Full text and trigram search over users.
+
+`User.search_vector` is maintained by a database trigger (see migration
+0006_user_search) and the substring lookups on username, email and
+document_id are served by trigram GIN indexes on their upper case value.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+SUBSTRING_FIELDS = ("username", "email", "document_id")
+
+
+def get_search_query(terms):
+    """Prefix query matching every term, e.g. `jo:* & v123:*`"""
+    words = [re.sub(r"[^\w@.+-]", "", term) for term in terms]
+    words = [word for word in words if word]
+    if not words:
+        return None
+    return SearchQuery(
+        " & ".join(f"'{word}':*" for word in words),
+        search_type="raw",
+        config="simple",
+    )
+
+
+def search_users(queryset, terms):
+    """
+    Filter `queryset` to the users matching all `terms`, annotated with a
+    `search_rank` relevance.
+    """
+    substring = Q()
+    for term in terms:
+        substring &= Q(
+            *[Q(**{f"{field}__icontains": term}) for field in SUBSTRING_FIELDS],
+            _connector=Q.OR,
+        )
+
+    query = get_search_query(terms)
+    if query is None:
+        return queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField()),
+        ).filter(substring)
+
+    # ts_rank is a real, widened to double precision it round-trips through
+    # a Python float, so the keyset pagination cursor compares equal to it
+    return queryset.annotate(
+        search_rank=Cast(SearchRank(F("search_vector"), query), FloatField()),
+    ).filter(Q(search_vector=query) | substring)
+
+
+class UserSearchFilter(SearchFilter):
+    """
+    `?search=` backed by `search_users`. Results are ordered by relevance
+    unless the client asks for an explicit `?ordering=`.
+    """
+
+    ordering = ("-search_rank", "-id")
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return search_users(queryset, terms).order_by(*self.ordering)
+
+    def get_ordering(self, request, queryset, view):
+        ordering_filter = OrderingFilter()
+        if self.get_search_terms(request) and not request.query_params.get(
+            ordering_filter.ordering_param
+        ):
+            return self.ordering
+        return ordering_filter.get_ordering(request, queryset, view)
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.core.exceptions import ValidationError
 from django.contrib.auth import password_validation
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.tokens import default_token_generator
 from django.urls.base import reverse
@@ -9,15 +10,100 @@ from django.utils.http import urlsafe_base64_encode
 from django.contrib.auth.forms import _unicode_ci_compare
 from django.contrib.sites.shortcuts import get_current_site
 from django_otp import verify_token
-from back.apps.user import mails
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from back.apps.user import activity, blacklist, cache, mails
 
 from .models import User
+from .tokens import UserRefreshToken
 
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = "__all__"
+        exclude = ["search_vector"]
+
+
+class UserBulkDataSerializer(serializers.ModelSerializer):
+    """Fields that can be set on many users at once"""
+
+    class Meta:
+        model = User
+        fields = [
+            "first_name",
+            "last_name",
+            "is_active",
+            "is_staff",
+            "is_superuser",
+            "groups",
+            "user_permissions",
+        ]
+
+    def validate(self, attrs):
+        if not attrs:
+            raise ValidationError(_("No field to update."), code="empty")
+        return attrs
+
+
+class UserBulkSelectionSerializer(serializers.Serializer):
+    """
+    The users `ids`, or every user matching the list filters of the query
+    string with `all_matching`
+    """
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        allow_empty=False,
+    )
+    all_matching = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if ("ids" in attrs) == attrs["all_matching"]:
+            raise ValidationError(
+                _("Give either a list of ids or all_matching."),
+                code="selection",
+            )
+        return attrs
+
+
+class UserBulkUpdateSerializer(UserBulkSelectionSerializer):
+    data = UserBulkDataSerializer()
+
+
+class UserBulkCreateSerializer(serializers.ModelSerializer):
+    password = serializers.CharField(
+        required=False,
+        write_only=True,
+        style={"input_type": "password"},
+    )
+
+    class Meta:
+        model = User
+        fields = [
+            "id",
+            "username",
+            "email",
+            "password",
+            "document_id",
+            "first_name",
+            "last_name",
+            "is_active",
+            "is_staff",
+        ]
+        # uniqueness is checked for the whole batch at once
+        extra_kwargs = {
+            "username": {"validators": [UnicodeUsernameValidator()]},
+            "email": {"validators": []},
+        }
+
+    def validate_password(self, password):
+        password_validation.validate_password(password)
+        return password
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -27,12 +113,52 @@ class UserProfileSerializer(serializers.ModelSerializer):
             "email",
             "username",
             "document_id",
-            "type",
             "first_name",
             "last_name",
         ]
 
 
+class UserTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return UserRefreshToken.for_user(user)
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # last_login is written by the activity flusher, not per login
+        activity.record(self.user.pk, "last_login", "last_seen")
+        return data
+
+
+class UserTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh for active users only, that reloads the user claims of the access
+    token (USER_TOKEN_CLAIMS) and keeps the rotated refresh tokens outstanding
+    """
+
+    def validate(self, attrs):
+        refresh = UserRefreshToken(attrs["refresh"])
+
+        user = User._default_manager.get_cached(refresh[api_settings.USER_ID_CLAIM])
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(
+                _("No active account found with the given credentials"),
+                code="no_active_account",
+            )
+        refresh.user = user
+
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+
+            refresh.rotate()
+            data["refresh"] = str(refresh)
+
+        return data
+
+
 def get_password_reset_url(user, token_generator=default_token_generator):
     """
     Generate a password-reset URL for a given user
@@ -54,16 +180,12 @@ class PasswordResetSerializer(serializers.Serializer):
         resetting their password.
         """
         email_field_name = User.get_email_field_name()
-        active_users = User._default_manager.filter(
-            **{
-                "%s__iexact" % email_field_name: email,
-                "is_active": True,
-            }
-        )
+        users = User._default_manager.filter_cached_by_email(email)
         return (
             u
-            for u in active_users
-            if u.has_usable_password()
+            for u in users
+            if u.is_active
+            and u.has_usable_password()
             and _unicode_ci_compare(email, getattr(u, email_field_name))
         )
 
@@ -111,7 +233,9 @@ class PasswordSerializer(serializers.Serializer):
     def save(self):
         password = self.validated_data
         self.user.set_password(password)
-        self.user.save()
+        self.user.save(update_fields=["password"])
+        cache.invalidate_user(self.user)
+        blacklist.revoke_user_tokens(self.user.pk)
         return self.user
 
 
@@ -182,7 +306,9 @@ class ChangePasswordSerializer(OTPChallengeSerializer):
     def save(self):
         password = self.validated_data
         self.user.set_password(password)
-        self.user.save()
+        self.user.save(update_fields=["password"])
+        cache.invalidate_user(self.user)
+        blacklist.revoke_user_tokens(self.user.pk)
         return self.user
 
 
@@ -195,6 +321,7 @@ class ChangeEmailSerializer(OTPChallengeSerializer):
                 _("The email has not changed."),
                 code="repeated_email",
             )
+        return email
 
     def validate(self, attrs):
         super().validate(attrs)
@@ -202,8 +329,12 @@ class ChangeEmailSerializer(OTPChallengeSerializer):
 
     def save(self):
         email = self.validated_data
+        old_email = self.user.email
         self.user.email = email
-        self.user.save()
+        self.user.save(update_fields=["email"])
+        cache.invalidate_profiles(self.user.pk)
+        cache.invalidate_user(self.user, old_email)
+        blacklist.revoke_user_tokens(self.user.pk)
         return self.user
 
 
@@ -226,23 +357,23 @@ class RegisterUserSerializer(UserProfileSerializer):
         password_validation.validate_password(attrs["password1"])
         return attrs
 
-    def save(self):
+    def get_user_data(self):
         data = self.validated_data
-        user_data = {
+        return {
             "username": data["username"],
             "password": data["password1"],
             "email": data["email"],
             "document_id": data["document_id"],
-            "type": data["type"],
             "first_name": data["first_name"],
             "last_name": data["last_name"],
         }
-        user = User.objects.create_user(**user_data)
+
+    def save(self):
+        user = User.objects.create_user(**self.get_user_data())
         return user
 
     class Meta(UserProfileSerializer.Meta):
         fields = UserProfileSerializer.Meta.fields + [
             "password1",
             "password2",
-            "account_type",
         ]
@@ -1,7 +1,31 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import Signal, receiver
+from simple_mail.models import SimpleMail, SimpleMailConfig
+
+from .cache import (
+    invalidate_profiles,
+    invalidate_user,
+    invalidate_users,
+    revoke_claims,
+)
+from .mails import clear_compiled_mails
 from .models import User, EmailDevice
 
+# sent per chunk by the bulk actions (`back.apps.user.bulk`) instead of
+# post_save, with `user_ids`, the changed `fields` (None when created)
+# and `created`. It also stands for m2m_changed: the bulk updates of groups
+# and user_permissions write the through tables, `fields` names them
+users_bulk_changed = Signal()
+
+
 @receiver(post_save, sender=User)
 def creating_user_settings(sender, instance, created, raw, **kwargs):
     """Creating the user device for a new User"""
@@ -9,3 +33,108 @@ def creating_user_settings(sender, instance, created, raw, **kwargs):
     if created and not raw:
         EmailDevice.objects.create(user=instance, name=f"personal device for user {instance.pk}", confirmed=True)
 
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidating_user_caches(sender, instance, **kwargs):
+    """Dropping the cached profile and lookups of a saved or deleted User"""
+
+    invalidate_profiles(instance.pk)
+    invalidate_user(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def revoking_user_claims(sender, instance, signal, **kwargs):
+    """The access tokens of a deactivated or deleted User stop authenticating"""
+
+    if settings.USER_TOKEN_CLAIMS and (signal is post_delete or not instance.is_active):
+        revoke_claims({instance.pk: instance.version})
+
+
+@receiver(users_bulk_changed, sender=User)
+def revoking_bulk_user_claims(sender, user_ids, fields, created, **kwargs):
+    """The access tokens of bulk deactivated Users stop authenticating"""
+
+    if settings.USER_TOKEN_CLAIMS and not created and "is_active" in fields:
+        revoke_claims(
+            dict(
+                User.objects.filter(pk__in=user_ids, is_active=False).values_list(
+                    "pk", "version"
+                )
+            )
+        )
+
+
+@receiver(users_bulk_changed, sender=User)
+def invalidating_bulk_user_caches(sender, user_ids, created, **kwargs):
+    """Dropping the cached profiles and lookups of a chunk of bulk changed Users"""
+
+    if not created:
+        invalidate_profiles(*user_ids)
+        invalidate_users(user_ids)
+        return
+
+    # cached misses of the new usernames and emails
+    usernames, emails = [], []
+    for username, email in User.objects.filter(pk__in=user_ids).values_list(
+        "username", "email"
+    ):
+        usernames.append(username)
+        emails.append(email)
+    invalidate_users(usernames=usernames, emails=emails)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def bumping_user_version(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Bumping the version of the Users whose groups or user_permissions
+    changed, they are part of their representation (ETags, cached profiles)
+    """
+
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        if pk_set or action == "pre_clear":
+            # UPDATE of the version alone, sends post_save
+            instance.save(update_fields=["version"])
+        return
+
+    field = "groups" if isinstance(instance, Group) else "user_permissions"
+    if action == "pre_clear":
+        pk_set = instance.user_set.values_list("pk", flat=True)
+    bump_versions(list(pk_set), field)
+
+
+@receiver(pre_delete, sender=Group)
+@receiver(pre_delete, sender=Permission)
+def bumping_members_version(sender, instance, **kwargs):
+    """Their rows of the through table are deleted without m2m_changed"""
+
+    field = "groups" if isinstance(instance, Group) else "user_permissions"
+    bump_versions(list(instance.user_set.values_list("pk", flat=True)), field)
+
+
+def bump_versions(user_ids, field):
+    if not user_ids:
+        return
+    User.objects.filter(pk__in=user_ids).update(version=F("version") + 1)
+    users_bulk_changed.send(
+        sender=User, user_ids=user_ids, fields=[field], created=False
+    )
+
+
+@receiver(post_save, sender=SimpleMail)
+@receiver(post_delete, sender=SimpleMail)
+def clearing_compiled_mail(sender, instance, **kwargs):
+    """Dropping the cached templates of an edited mail"""
+
+    clear_compiled_mails(instance.key)
+
+
+@receiver(post_save, sender=SimpleMailConfig)
+def clearing_compiled_mails(sender, instance, **kwargs):
+    """The mail config is part of every cached mail"""
+
+    clear_compiled_mails()
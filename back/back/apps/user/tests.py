@@ -1,3 +1,1657 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import tempfile
+import socket
+import statistics
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache, caches
+from django.core import mail as django_mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.smtp import EmailBackend
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models.signals import post_save
+from django.test import (
+    AsyncClient,
+    LiveServerTestCase,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    modify_settings,
+    override_settings,
+    tag,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from drf_spectacular.generators import SchemaGenerator
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import RefreshToken
+from simple_mail.mailer import simple_mailer
+
+from back.core import schema
+from back.core.db import metrics
+from back.core.db_routers import ReplicaRoutingMiddleware
+from back.core.mail_backends import PooledEmailBackend, get_pool
+from back.core.pagination import KeysetPagination
+from back.core.renderers import ORJSONRenderer
+from back.core.throttling import SlidingWindowThrottle
+from back.core.transactions import TransactionPolicyMiddleware
+
+from . import (
+    activity,
+    async_views,
+    blacklist,
+    bulk,
+    dispatch,
+    mails,
+    signals,
+    views,
+)
+from .authentication import ClaimsJWTAuthentication
+from .blacklist import BlacklistFilter
+from .cache import get_cache, get_profile_key, get_user_key
+from .management.commands import send_outbox
+from .models import EmailDevice, MailOutbox, User
+from .serializers import UserSerializer
+from .tokens import ClaimsUser, UserRefreshToken
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:  # requirements/dev.txt
+    Controller = None
+
+# the async views, for the tests that route them (ROOT_URLCONF=__name__)
+urlpatterns = [
+    path("token/", async_views.token_obtain_pair),
+    path("user/profile/", async_views.profile),
+    path("user/generate-otp/", async_views.send_otp),
+]
+
+
+def create_user(username, **kwargs):
+    kwargs.setdefault("email", f"{username}@example.com")
+    kwargs.setdefault("document_id", "V1")
+    return User.objects.create_user(username=username, password="secret", **kwargs)
+
+
+# reads from the primary, the replicas do not see the test case transaction
+@override_settings(DATABASE_REPLICAS=[])
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user("admin", is_staff=True, is_superuser=True)
+        # within the same millisecond, only the microseconds differ
+        joined = timezone.now().replace(microsecond=123000)
+        for i in range(5):
+            create_user(f"user{i}", date_joined=joined + timedelta(microseconds=i))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get_all_pages(self, query):
+        ids = []
+        url = f"/users/?{query}&limit=2"
+        while url:
+            # a cursor that does not move would loop forever
+            self.assertLessEqual(len(ids), User.objects.count())
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [user["id"] for user in response.json()["results"]]
+            url = response.json()["next"]
+        return ids
+
+    def test_pages_cover_every_row_once(self):
+        for ordering in ("date_joined", "-date_joined"):
+            with self.subTest(ordering=ordering):
+                tie_breaker = "-id" if ordering.startswith("-") else "id"
+                expected = list(
+                    User.objects.order_by(ordering, tie_breaker).values_list(
+                        "id", flat=True
+                    )
+                )
+                ids = self.get_all_pages(f"ordering={ordering}")
+                self.assertEqual(ids, expected)
+
+    def test_search_pages_cover_every_match_once(self):
+        for i in range(5):
+            create_user(f"john{i}", first_name="John")
+        ids = self.get_all_pages("search=john")
+        self.assertEqual(len(ids), 5)
+        johns = User.objects.filter(first_name="John").values_list("id", flat=True)
+        self.assertEqual(set(ids), set(johns))
+
+    def test_keyset_filter_bounds_the_first_field(self):
+        position = [timezone.now(), 10]
+        condition = KeysetPagination().get_keyset_filter(
+            ["-date_joined", "-id"], position
+        )
+        self.assertIn(("date_joined__lte", position[0]), condition.children)
+
+
+# reads from the primary, the replicas do not see the test case transaction
+@override_settings(DATABASE_REPLICAS=[], USER_EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user("admin", is_staff=True, is_superuser=True)
+        for i in range(4):
+            create_user(f"user{i}")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get_exported_ids(self):
+        response = self.client.get("/users/export/?fields=id,username")
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).splitlines()
+        return [json.loads(line)["id"] for line in lines]
+
+    def test_export_through_server_side_cursor(self):
+        ids = self.get_exported_ids()
+        self.assertCountEqual(ids, User.objects.values_list("id", flat=True))
+
+    def test_export_by_pk_pages_behind_pooler(self):
+        settings_dict = connections["default"].settings_dict
+        with mock.patch.dict(settings_dict, {"DISABLE_SERVER_SIDE_CURSORS": True}):
+            ids = self.get_exported_ids()
+        self.assertEqual(ids, sorted(User.objects.values_list("id", flat=True)))
+
+
+# the ASGI handler opens and closes connections, outside of a transaction
+@override_settings(DATABASE_REPLICAS=[])
+class ASGIExportTests(TransactionTestCase):
+    def setUp(self):
+        self.admin = create_user("admin", is_staff=True, is_superuser=True)
+        for i in range(4):
+            create_user(f"user{i}")
+
+    def tearDown(self):
+        activity.flush()
+
+    @async_to_sync
+    async def get(self, path, token):
+        """The status and body of `path` served by the ASGI handler"""
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+        communicator = ApplicationCommunicator(get_asgi_application(), scope)
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output(timeout=10)
+        body = b""
+        while True:
+            message = await communicator.receive_output(timeout=10)
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return start["status"], body
+
+    def test_export(self):
+        token = RefreshToken.for_user(self.admin).access_token
+        # each request has a thread, and a connection, of its own: closed
+        # after it as in the asgi mode
+        with mock.patch.dict(connections.settings[DEFAULT_DB_ALIAS], CONN_MAX_AGE=0):
+            status, body = self.get("/users/export/", token)
+        self.assertEqual(status, 200, body)
+        ids = [json.loads(line)["id"] for line in body.splitlines()]
+        self.assertCountEqual(ids, User.objects.values_list("id", flat=True))
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class BulkActionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user("admin", is_staff=True, is_superuser=True)
+        cls.users = [create_user(f"user{i}") for i in range(5)]
+        cls.old_group = Group.objects.create(name="old")
+        cls.new_group = Group.objects.create(name="new")
+        for user in cls.users:
+            user.groups.add(cls.old_group)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def post(self, action, data):
+        return self.client.post(f"/users/bulk-{action}/", data, format="json")
+
+    def test_update_validation(self):
+        ids = [self.users[0].pk]
+        for data in (
+            {"ids": ids, "data": {}},
+            {"data": {"first_name": "Ada"}},
+            {"ids": ids, "all_matching": True, "data": {"first_name": "Ada"}},
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(self.post("update", data).status_code, 400)
+
+        response = self.post("deactivate", {"ids": [self.admin.pk, 999999]})
+        self.assertEqual(response.json()["updated"], 0)
+        errors = response.json()["errors"]
+        self.assertEqual(set(errors), {str(self.admin.pk), "999999"})
+
+    @override_settings(USER_BULK_CHUNK_SIZE=2)
+    def test_update_by_chunks(self):
+        ids = [user.pk for user in self.users[:4]]
+        receiver = mock.Mock()
+        signals.users_bulk_changed.connect(receiver, sender=User)
+        self.addCleanup(signals.users_bulk_changed.disconnect, receiver, sender=User)
+
+        versions = dict(User.objects.values_list("pk", "version"))
+        data = {"last_name": "Lovelace", "groups": [self.new_group.pk]}
+        response = self.post("update", {"ids": ids, "data": data})
+        self.assertEqual(response.json(), {"updated": 4, "errors": {}})
+        self.assertEqual(
+            [call.kwargs["user_ids"] for call in receiver.call_args_list],
+            [ids[:2], ids[2:]],
+        )
+
+        # replaced on the selected users only
+        for user in self.users:
+            user.refresh_from_db()
+            groups = list(user.groups.all())
+            if user.pk in ids:
+                self.assertEqual(groups, [self.new_group])
+                self.assertEqual(user.last_name, "Lovelace")
+                self.assertEqual(user.version, versions[user.pk] + 1)
+            else:
+                self.assertEqual(groups, [self.old_group])
+                self.assertEqual(user.version, versions[user.pk])
+
+    def test_create_reports_invalid_rows(self):
+        response = self.post(
+            "create",
+            [
+                {"username": "ada", "email": "ada@example.com", "document_id": "V1"},
+                {"username": "user0", "email": "new@example.com", "document_id": "V1"},
+                {"username": "bob", "email": "ada@example.com", "document_id": "V1"},
+                {"username": "eve", "email": "eve@example.com", "document_id": "X"},
+            ],
+        )
+        self.assertEqual(response.status_code, 201)
+        ada = User.objects.get(username="ada")
+        self.assertEqual(response.json()["created"], [{"index": 0, "id": ada.pk}])
+        self.assertEqual(
+            {index: set(errors) for index, errors in response.json()["errors"].items()},
+            {"1": {"username"}, "2": {"email"}, "3": {"document_id"}},
+        )
+        self.assertFalse(ada.has_usable_password())
+        self.assertTrue(EmailDevice.objects.filter(user=ada).exists())
+
+    @override_settings(USER_BULK_CREATE_MAX_ROWS=2)
+    def test_create_size_is_capped(self):
+        rows = [
+            {"username": f"new{i}", "email": f"new{i}@example.com"} for i in range(3)
+        ]
+        self.assertEqual(self.post("create", rows).status_code, 400)
+        self.assertFalse(User.objects.filter(username__startswith="new").exists())
+
+    def test_create_rows_taken_meanwhile(self):
+        # past `get_unique_conflicts`, as after a concurrent request
+        rows = [
+            (0, {"username": "ada", "email": "ada@example.com", "document_id": "V1"}),
+            (1, {"username": "user1", "email": "bob@example.com", "document_id": "V2"}),
+        ]
+        created, errors = bulk.create_users(rows)
+        self.assertEqual([index for index, user in created], [0])
+        self.assertEqual(list(errors), [1])
+        self.assertTrue(User.objects.filter(username="ada").exists())
+
+
+# within a window, the estimate drops right after it rolls over
+@mock.patch.object(SlidingWindowThrottle, "timer", mock.Mock(return_value=1000.0))
+@mock.patch.object(SlidingWindowThrottle, "THROTTLE_RATES", {"login.ip": "3/min"})
+class IPThrottleTests(TestCase):
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+
+    def login(self, **headers):
+        return self.client.post(
+            "/token/", {"username": "nobody", "password": "wrong"}, **headers
+        )
+
+    def test_forwarded_for_does_not_reset_the_count(self):
+        for i in range(3):
+            self.assertEqual(self.login(HTTP_X_FORWARDED_FOR=f"10.0.0.{i}").status_code, 401)
+        response = self.login(HTTP_X_FORWARDED_FOR="10.0.0.9")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+    def test_client_behind_proxy(self):
+        rest_framework = {**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            # the proxy appends the address it got the request from
+            for i in range(3):
+                response = self.login(HTTP_X_FORWARDED_FOR=f"10.0.0.{i}, 1.2.3.4")
+                self.assertEqual(response.status_code, 401)
+            self.assertEqual(self.login(HTTP_X_FORWARDED_FOR="1.2.3.4").status_code, 429)
+            self.assertEqual(self.login(HTTP_X_FORWARDED_FOR="5.6.7.8").status_code, 401)
+
+    def test_counts_by_client_ip_by_default(self):
+        view = mock.Mock(throttle_scope="login")
+        request = mock.Mock(META={"REMOTE_ADDR": "1.2.3.4"})
+        for _ in range(3):
+            self.assertTrue(SlidingWindowThrottle().allow_request(request, view))
+        self.assertFalse(SlidingWindowThrottle().allow_request(request, view))
+        request.META["REMOTE_ADDR"] = "5.6.7.8"
+        self.assertTrue(SlidingWindowThrottle().allow_request(request, view))
+
+
+@tag("load")
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "NUM_PROXIES": 1})
+@mock.patch.object(SlidingWindowThrottle, "THROTTLE_RATES", {"login.ip": "30/hour"})
+class LoginThrottleLoadTests(LiveServerTestCase):
+    """
+    Latency of legitimate logins while another client tries wrong credentials
+    at `attack_rate` per second, more password checks than a core can answer.
+    The live server, its clients and the database may share a single core,
+    the bound leaves room for that. Skip with ``--exclude-tag load``.
+    """
+
+    attackers = 4
+    attack_rate = 10
+    logins = 20
+
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+        create_user("legit")
+
+    def tearDown(self):
+        # the buffered last_login, while the tables exist
+        activity.flush()
+
+    def login(self, username, password, ip):
+        request = Request(
+            f"{self.live_server_url}/token/",
+            data=json.dumps({"username": username, "password": password}).encode(),
+            headers={"Content-Type": "application/json", "X-Forwarded-For": ip},
+        )
+        try:
+            urlopen(request).close()
+            return 200
+        except HTTPError as error:
+            return error.code
+
+    def get_p99(self, ip):
+        latencies = []
+        for _ in range(self.logins):
+            start = time.perf_counter()
+            self.assertEqual(self.login("legit", "secret", ip), 200)
+            latencies.append(time.perf_counter() - start)
+        return statistics.quantiles(latencies, n=100)[98]
+
+    def attack(self, stop, statuses):
+        interval = self.attackers / self.attack_rate
+        n = 0
+        while not stop.wait(interval):
+            n += 1
+            statuses.append(self.login(f"victim{n}", "wrong", "10.6.6.6"))
+
+    def test_legitimate_p99_under_attack(self):
+        baseline = self.get_p99("10.0.0.1")
+
+        stop, statuses = threading.Event(), []
+        threads = [
+            threading.Thread(target=self.attack, args=(stop, statuses))
+            for _ in range(self.attackers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            # once the attempts the rate allows are spent, and answered
+            while 429 not in statuses:
+                time.sleep(0.1)
+            time.sleep(1)
+            under_attack = self.get_p99("10.0.0.2")
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        # past the first 30 the attempts are refused before any hashing, give
+        # or take the concurrent checks and a window boundary
+        allowed = 2 * 30
+        self.assertLessEqual(statuses.count(401), allowed)
+        self.assertGreaterEqual(statuses.count(429), len(statuses) - allowed)
+        self.assertGreater(len(statuses), allowed)
+        self.assertLess(
+            under_attack,
+            2.5 * baseline,
+            f"p99 {baseline * 1000:.0f} ms, {under_attack * 1000:.0f} ms under "
+            f"attack ({len(statuses)} attempts)",
+        )
+
+
+class RecordingMiddleware:
+    """Records the view hooks it is called with"""
+
+    calls = []
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.calls.append("process_view")
+
+    def process_exception(self, request, exception):
+        self.calls.append("process_exception")
+
+
+# reads from the primary, the replicas do not see the test case transaction
+@override_settings(DATABASE_REPLICAS=[])
+class TransactionPolicyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user("admin", is_staff=True, is_superuser=True)
+
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def tearDown(self):
+        activity.flush()
+
+    def request(self, method, path, data=None):
+        """The queries of the request, and its response"""
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, format="json")
+        return [query["sql"] for query in queries], response
+
+    def opens_transaction(self, method, path, data=None):
+        # within the test case transaction, the one of the request is a
+        # savepoint
+        queries, response = self.request(method, path, data)
+        self.assertLess(response.status_code, 400)
+        return any(sql.startswith("SAVEPOINT") for sql in queries)
+
+    def test_reads_run_in_autocommit(self):
+        token = str(RefreshToken.for_user(self.admin).access_token)
+        for method, path, data in (
+            ("get", "/user/profile/", None),
+            ("get", "/users/", None),
+            ("get", f"/users/{self.admin.pk}/", None),
+            ("get", "/users/export/", None),
+            ("post", "/token/verify/", {"token": token}),
+        ):
+            with self.subTest(method=method, path=path):
+                self.assertFalse(self.opens_transaction(method, path, data))
+
+    def test_writes_are_atomic(self):
+        for method, path, data in (
+            ("patch", f"/users/{self.admin.pk}/", {"first_name": "Ada"}),
+            ("post", "/token/", {"username": "admin", "password": "secret"}),
+        ):
+            with self.subTest(method=method, path=path):
+                self.assertTrue(self.opens_transaction(method, path, data))
+
+    def test_error_response_rolls_back(self):
+        queries, response = self.request(
+            "patch", f"/users/{self.admin.pk}/", {"email": "not an email"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(queries[-2].startswith("ROLLBACK TO SAVEPOINT"))
+
+    @modify_settings(MIDDLEWARE={"append": f"{__name__}.RecordingMiddleware"})
+    def test_later_view_middleware_runs(self):
+        RecordingMiddleware.calls = []
+        self.client.raise_request_exception = False
+        with mock.patch.object(
+            views.UserViewSet, "partial_update", side_effect=RuntimeError
+        ):
+            queries, response = self.request(
+                "patch", f"/users/{self.admin.pk}/", {"first_name": "Ada"}
+            )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(RecordingMiddleware.calls, ["process_view", "process_exception"])
+        self.assertTrue(queries[-2].startswith("ROLLBACK TO SAVEPOINT"))
+
+    @override_settings(TRANSACTION_POLICY="atomic")
+    def count_atomic_queries(self, path):
+        return len(self.request("get", path)[0])
+
+    def test_round_trips_saved(self):
+        for path in ("/user/profile/", "/users/"):
+            with self.subTest(path=path):
+                # warm the caches up
+                self.request("get", path)
+                queries = len(self.request("get", path)[0])
+                # BEGIN and COMMIT, SAVEPOINT and RELEASE SAVEPOINT here
+                self.assertEqual(self.count_atomic_queries(path), queries + 2)
+
+    def test_async_handler(self):
+        client = AsyncClient()
+
+        @async_to_sync
+        async def post(path, data):
+            # the sync views run in this thread, on its connection
+            return await client.post(path, data, content_type="application/json")
+
+        for path, data, atomic in (
+            ("/token/", {"username": "admin", "password": "secret"}, True),
+            ("/token/verify/", {"token": "invalid"}, False),
+        ):
+            with self.subTest(path=path):
+                with CaptureQueriesContext(connection) as queries:
+                    response = post(path, data)
+                self.assertLess(response.status_code, 500)
+                self.assertEqual(
+                    any(q["sql"].startswith("SAVEPOINT") for q in queries), atomic
+                )
+
+    def test_middlewares_keep_the_chain_async(self):
+        async def get_response(request):
+            return None
+
+        def get_response_sync(request):
+            return None
+
+        for middleware_class in (TransactionPolicyMiddleware, ReplicaRoutingMiddleware):
+            with self.subTest(middleware=middleware_class.__name__):
+                middleware = middleware_class(get_response)
+                self.assertTrue(asyncio.iscoroutinefunction(middleware))
+                middleware = middleware_class(get_response_sync)
+                self.assertFalse(asyncio.iscoroutinefunction(middleware))
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "set DATABASE_REPLICA_HOSTS")
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Two databases, the replica (a test mirror) reads the committed rows of
+    the primary
+    """
+
+    databases = {"default", *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        cache.clear()
+        self.admin = create_user("admin", is_staff=True, is_superuser=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def tearDown(self):
+        activity.flush()
+
+    def get_databases(self, method, path, data=None, client=None):
+        """The aliases the request queried"""
+        client = client or self.client
+        with contextlib.ExitStack() as stack:
+            captured = {
+                alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in self.databases
+            }
+            response = getattr(client, method)(path, data, format="json")
+        self.assertLess(response.status_code, 400)
+        return {alias for alias, queries in captured.items() if len(queries)}
+
+    def test_reads_go_to_a_replica(self):
+        for path in ("/users/", f"/users/{self.admin.pk}/"):
+            with self.subTest(path=path):
+                databases = self.get_databases("get", path)
+                self.assertEqual(len(databases), 1)
+                self.assertLessEqual(databases, set(settings.DATABASE_REPLICAS))
+
+    def test_writes_go_to_the_primary(self):
+        databases = self.get_databases(
+            "patch", f"/users/{self.admin.pk}/", {"first_name": "Ada"}
+        )
+        self.assertEqual(databases, {"default"})
+
+    def test_client_sticks_to_the_primary_after_writing(self):
+        self.get_databases("patch", f"/users/{self.admin.pk}/", {"first_name": "Ada"})
+        self.assertIn(settings.REPLICA_STICKY_COOKIE_NAME, self.client.cookies)
+        self.assertEqual(self.get_databases("get", "/users/"), {"default"})
+
+    def test_user_sticks_to_the_primary_after_writing(self):
+        self.get_databases("patch", f"/users/{self.admin.pk}/", {"first_name": "Ada"})
+        # a token client without the cookie
+        client = APIClient()
+        token = RefreshToken.for_user(self.admin).access_token
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(self.get_databases("get", "/users/", client=client), {"default"})
+
+
+@override_settings(DATABASE_REPLICAS=[], USER_ACTIVITY_ENABLED=True)
+class ActivityTests(TestCase):
+    def setUp(self):
+        activity.flush()
+        self.users = [create_user("ada"), create_user("grace")]
+
+    def test_hits_are_coalesced(self):
+        now = timezone.now()
+        for seconds in range(5):
+            for user in self.users:
+                activity.record(user.pk, when=now + timedelta(seconds=seconds))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(activity.flush(), 2)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("UPDATE"))
+        for user in self.users:
+            user.refresh_from_db()
+            self.assertEqual(user.last_seen, now + timedelta(seconds=4))
+
+        # older activity does not go back in time
+        activity.record(self.users[0].pk, when=now)
+        self.assertEqual(activity.flush(), 0)
+
+    def test_flushed_on_shutdown(self):
+        with mock.patch.object(activity, "_flusher_pid", None), mock.patch.object(
+            activity.threading, "Thread"
+        ), mock.patch.object(activity.atexit, "register") as register:
+            activity.record(self.users[0].pk, "last_login", "last_seen")
+        register.assert_called_once_with(activity.flush)
+
+        # at exit
+        register.call_args.args[0]()
+        user = User.objects.get(pk=self.users[0].pk)
+        self.assertIsNotNone(user.last_login)
+        self.assertEqual(user.last_seen, user.last_login)
+
+
+@override_settings(DATABASE_REPLICAS=[], USER_TOKEN_CLAIMS=True)
+@mock.patch.object(APIView, "authentication_classes", [ClaimsJWTAuthentication])
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user("ada", first_name="Ada", is_staff=True)
+        self.client = APIClient()
+        self.authenticate(self.user)
+
+    def tearDown(self):
+        activity.flush()
+
+    def authenticate(self, user):
+        token = UserRefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        return token
+
+    def test_no_user_query(self):
+        # nor a cached one
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/user/profile/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["first_name"], "Ada")
+        self.assertEqual(len(queries), 0)
+
+    def test_claims_user(self):
+        token = self.authenticate(self.user)
+        user = ClaimsJWTAuthentication().get_user(token)
+        self.assertIsInstance(user, ClaimsUser)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.username, "ada")
+            self.assertTrue(user.is_staff)
+            self.assertEqual(user.version, self.user.version)
+            self.assertEqual(user, self.user)
+        # anything else loads the user
+        self.assertEqual(user.date_joined, self.user.date_joined)
+        self.assertFalse(user.has_perm("user.delete_user"))
+
+    def test_permissions(self):
+        self.assertEqual(self.client.get("/users/").status_code, 200)
+        self.authenticate(create_user("grace"))
+        self.assertEqual(self.client.get("/users/").status_code, 403)
+
+    def test_inactive_claims(self):
+        self.user.is_active = False
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get("/user/profile/").status_code, 401)
+
+    def test_deactivated_user(self):
+        self.user.is_active = False
+        self.user.save(update_fields=["is_active"])
+        response = self.client.get("/user/profile/")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["code"], "user_revoked")
+
+        # reactivated, the new tokens authenticate
+        self.user.is_active = True
+        self.user.save(update_fields=["is_active"])
+        self.assertEqual(self.client.get("/user/profile/").status_code, 401)
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get("/user/profile/").status_code, 200)
+
+    def test_bulk_deactivated_user(self):
+        admin = create_user("admin", is_staff=True, is_superuser=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        client.post("/users/bulk-deactivate/", {"ids": [self.user.pk]}, format="json")
+        self.assertEqual(self.client.get("/user/profile/").status_code, 401)
+
+    def test_deleted_user(self):
+        self.user.delete()
+        self.assertEqual(self.client.get("/user/profile/").status_code, 401)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class UserQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user("admin", is_staff=True)
+        cls.users = [create_user(f"user{n}") for n in range(10)]
+        permission = Permission.objects.first()
+        for user in cls.users:
+            user.groups.add(Group.objects.create(name=user.username))
+            user.user_permissions.add(permission)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_list(self):
+        # the page, then the groups and the permissions of all its users
+        for limit in (2, 10):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f"/users/?limit={limit}")
+            self.assertEqual(len(response.json()["results"]), limit)
+            self.assertEqual(len(queries), 3)
+        self.assertNotIn("search_vector", queries[0]["sql"])
+
+    def test_retrieve(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/users/{self.users[0].pk}/")
+        self.assertEqual(len(response.json()["groups"]), 1)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user("admin", is_staff=True, first_name="Ada")
+        cls.admin.groups.add(Group.objects.create(name="staff"))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), [query["sql"] for query in queries]
+
+    def test_unknown_fields(self):
+        for param in ("fields", "omit"):
+            with self.subTest(param=param):
+                response = self.client.get(f"/users/?{param}=username,nope")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("nope", response.json()["detail"][param][0])
+
+    def test_only_the_rendered_columns_are_selected(self):
+        data, queries = self.get("/users/")
+        self.assertIn('"first_name"', queries[0])
+        self.assertEqual(len(queries), 3)
+
+        data, queries = self.get("/users/?fields=id,username")
+        self.assertEqual(set(data["results"][0]), {"id", "username"})
+        # the view's own ordering and ETag columns, no prefetch
+        self.assertEqual(len(queries), 1)
+        for column in ("first_name", "document_id", "password", "is_superuser"):
+            self.assertNotIn(f'"{column}"', queries[0])
+
+        data, queries = self.get(
+            f"/users/{self.admin.pk}/?omit=groups,user_permissions,first_name"
+        )
+        self.assertNotIn("first_name", data)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"first_name"', queries[0])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class LookupIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("ada")
+
+    def setUp(self):
+        get_cache().clear()
+
+    def get_plans(self, lookup):
+        """The plan of each query of `lookup`"""
+        with CaptureQueriesContext(connection) as queries:
+            lookup()
+        plans = []
+        with connection.cursor() as cursor:
+            # the table is too small for the planner to prefer an index
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            for query in queries:
+                cursor.execute(f"EXPLAIN {query['sql']}")
+                plans.append("\n".join(row[0] for row in cursor.fetchall()))
+        return plans
+
+    def test_login_lookup(self):
+        plans = self.get_plans(lambda: User.objects.get_cached_by_natural_key("ada"))
+        # exact match, on the unique index (or its `_like` twin)
+        self.assertIn("Index Cond: ((username)::text = 'ada'::text)", plans[0])
+
+    def test_password_reset_lookup(self):
+        plans = self.get_plans(
+            lambda: User.objects.filter_cached_by_email("ADA@example.com")
+        )
+        self.assertIn("user_active_email_upper_idx", plans[0])
+
+
+@override_settings(USER_CACHE_TIMEOUT=300, USER_CACHE_MISS_TIMEOUT=60)
+class UserCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("ada")
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_password_hash_is_not_cached(self):
+        User.objects.get_cached(self.user.pk)
+        values = get_cache().get(get_user_key("pk", self.user.pk))
+        self.assertEqual(values["username"], "ada")
+        self.assertNotIn("password", values)
+
+        with self.assertNumQueries(0):
+            user = User.objects.get_cached(self.user.pk)
+        # loaded on access
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password("secret"))
+
+    def test_lookup_by_email_skips_inactive_users(self):
+        create_user("bob", email="BOB@example.com", is_active=False)
+        self.assertEqual(User.objects.filter_cached_by_email("bob@example.com"), [])
+        self.assertEqual(
+            User.objects.filter_cached_by_email("ADA@example.com"), [self.user]
+        )
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = create_user("ada")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_variants_of_the_same_fields_share_an_entry(self):
+        for query in (
+            "fields=email,username",
+            "fields=username,%20email",
+            "omit=document_id,first_name,last_name",
+        ):
+            response = self.client.get(f"/user/profile/?{query}")
+            self.assertEqual(
+                response.json(), {"email": "ada@example.com", "username": "ada"}
+            )
+        entry = get_cache().get(get_profile_key(self.user.pk))
+        self.assertEqual(list(entry["data"]), ["email,username"])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class UserVersionTests(TestCase):
+    def setUp(self):
+        self.admin = create_user("admin", is_staff=True)
+        self.user = create_user("ada")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def assertBumped(self, user_id, version):
+        self.assertGreater(User.objects.get(pk=user_id).version, version)
+
+    def test_concurrent_saves_each_bump_the_version(self):
+        user = self.user
+        first, second = User.objects.get(pk=user.pk), User.objects.get(pk=user.pk)
+        first.first_name = "Ada"
+        first.save()
+        second.last_name = "Lovelace"
+        second.save(update_fields=["last_name"])
+        self.assertEqual(second.version, user.version + 2)
+        user.refresh_from_db()
+        self.assertEqual(user.version, second.version)
+
+    def test_post_save_receivers_see_the_new_version(self):
+        versions = []
+
+        def receiver(sender, instance, **kwargs):
+            versions.append(instance.version)
+
+        post_save.connect(receiver, sender=User)
+        self.addCleanup(post_save.disconnect, receiver, sender=User)
+        version = self.user.version
+        # the UPDATE alone, the version comes back with it
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=["first_name"])
+        self.assertEqual(versions, [version + 1])
+
+    def test_many_to_many_changes_bump_the_version(self):
+        group = Group.objects.create(name="staff")
+        permission = Permission.objects.first()
+        changes = [
+            lambda: self.user.groups.add(group),
+            lambda: self.user.groups.remove(group),
+            lambda: group.user_set.add(self.user),
+            lambda: group.user_set.clear(),
+            lambda: self.user.user_permissions.set([permission]),
+            lambda: permission.user_set.remove(self.user),
+            lambda: self.user.groups.add(group),
+            lambda: group.delete(),
+        ]
+        for change in changes:
+            version = User.objects.get(pk=self.user.pk).version
+            change()
+            self.assertBumped(self.user.pk, version)
+
+    def test_etag_changes_with_the_groups(self):
+        url = f"/users/{self.user.pk}/"
+        etag = self.client.get(url)["ETag"]
+        self.user.groups.add(Group.objects.create(name="staff"))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["groups"]), 1)
+
+    def test_list_etag_changes_with_the_pagination(self):
+        url = "/users/?limit=2"
+        response = self.client.get(url)
+        self.assertIsNone(response.json()["next"])
+        # the same page, with a following one
+        create_user("grace", date_joined=timezone.now() - timedelta(days=1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json()["next"])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+
+class SchemaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema = SchemaGenerator().get_schema(request=None, public=True)
+
+    def get_component(self, path, direction="responses"):
+        operation = self.schema["paths"][path]["post"]
+        if direction == "responses":
+            content = operation["responses"]["200"]["content"]
+        else:
+            content = operation["requestBody"]["content"]
+        name = content["application/json"]["schema"]["$ref"].rsplit("/", 1)[-1]
+        return self.schema["components"]["schemas"][name]
+
+    def test_bearer_authentication(self):
+        schemes = self.schema["components"]["securitySchemes"]
+        self.assertEqual(schemes["jwtAuth"]["scheme"], "bearer")
+        self.assertIn({"jwtAuth": []}, self.schema["paths"]["/users/"]["get"]["security"])
+
+    def test_docs_ui_views_are_excluded(self):
+        paths = [path for path in self.schema["paths"] if path.startswith("/docs/")]
+        self.assertEqual(paths, ["/docs/schema/"])
+
+    def test_token_responses(self):
+        pair = self.get_component("/token/")["properties"]
+        self.assertEqual(set(pair), {"username", "password", "access", "refresh"})
+        self.assertTrue(pair["access"]["readOnly"])
+        refresh = self.get_component("/token/refresh/")["properties"]
+        self.assertTrue(refresh["access"]["readOnly"])
+
+
+class PrebuiltSchemaTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        settings_override = override_settings(SCHEMA_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # the manifest and files are read once per process
+        for patcher in (
+            mock.patch.object(schema, "_manifest", None),
+            mock.patch.dict(schema._files, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def build(self):
+        return schema.build_schema(self.root)["version"]
+
+    def test_etag(self):
+        self.build()
+        response = self.client.get("/docs/schema/", HTTP_ACCEPT_ENCODING="identity")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, no-cache")
+        self.assertNotIn("Content-Encoding", response)
+
+        response = self.client.get(
+            "/docs/schema/",
+            HTTP_ACCEPT_ENCODING="identity",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_encodings(self):
+        self.build()
+        plain = self.client.get("/docs/schema/").content
+        response = self.client.get("/docs/schema/", HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), plain)
+        if schema.brotli is not None:
+            response = self.client.get("/docs/schema/", HTTP_ACCEPT_ENCODING="gzip, br")
+            self.assertEqual(response["Content-Encoding"], "br")
+            self.assertEqual(schema.brotli.decompress(response.content), plain)
+
+    def test_versioned_url_is_immutable(self):
+        version = self.build()
+        response = self.client.get(f"/docs/schema/{version}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(self.client.get("/docs/schema/0123/").status_code, 404)
+
+    def test_missing_build(self):
+        self.assertEqual(self.client.get("/docs/schema/").status_code, 404)
+        with override_settings(DEBUG=True):
+            response = self.client.get("/docs/schema/")
+        # generated live
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+
+
+class RegistrationTests(TestCase):
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+        simple_mailer.save_mails()
+
+    def register(self):
+        return self.client.post(
+            "/user/register/",
+            {
+                "username": "ada",
+                "email": "ada@example.com",
+                "password1": "Secret-passw0rd",
+                "password2": "Secret-passw0rd",
+                "document_id": "V1",
+                "first_name": "Ada",
+                "last_name": "Lovelace",
+            },
+        )
+
+    def test_welcome_mail_written_to_the_outbox(self):
+        # on_commit callbacks do not run in a test case
+        response = self.register()
+        self.assertEqual(response.status_code, 201, response.content)
+        outbox = MailOutbox.objects.get()
+        self.assertEqual(outbox.to, ["ada@example.com"])
+
+    @override_settings(MAIL_OUTBOX_ENABLED=False, USER_SIDE_EFFECTS_ASYNC=True)
+    def test_welcome_mail_sent_from_one_background_task(self):
+        executor = mock.Mock()
+        with mock.patch.object(
+            dispatch, "get_executor", return_value=executor
+        ), self.captureOnCommitCallbacks(execute=True):
+            response = self.register()
+        self.assertEqual(response.status_code, 201, response.content)
+        # the pool thread sends it, without deferring it again
+        executor.submit.assert_called_once()
+        with mock.patch.object(
+            dispatch.connections, "close_all"
+        ), self.captureOnCommitCallbacks(execute=True):
+            executor.submit.call_args.args[0](*executor.submit.call_args.args[1:])
+        executor.submit.assert_called_once()
+        self.assertEqual(django_mail.outbox[0].to, ["ada@example.com"])
+        self.assertFalse(MailOutbox.objects.exists())
+
+
+@tag("load")
+class MailRenderTests(TestCase):
+    """
+    Renders of the welcome mail with the templates compiled once per process
+    and with simple_mail's own render, which reads and parses them each time.
+    Both inline the CSS with premailer, which takes most of a render: the
+    templates are timed without it. Skip with ``--exclude-tag load``.
+    """
+
+    renders = 30
+
+    def setUp(self):
+        simple_mailer.save_mails()
+        mails.clear_compiled_mails()
+        self.mail = mails.WelcomeMail()
+        self.mail.set_context(create_user("ada"))
+
+    def render_uncached(self):
+        return self.mail.get_mail().render(self.mail.context, self.mail.template)
+
+    def time_renders(self, render):
+        start = time.perf_counter()
+        for _ in range(self.renders):
+            render()
+        return (time.perf_counter() - start) / self.renders
+
+    def test_compiled_render(self):
+        self.assertEqual(self.mail.render(), self.render_uncached())
+
+        with mock.patch("simple_mail.models.transform", str), mock.patch.object(
+            mails, "transform", str
+        ):
+            uncached = self.time_renders(self.render_uncached)
+            with self.assertNumQueries(0):
+                compiled = self.time_renders(self.mail.render)
+        self.assertLess(
+            compiled,
+            uncached,
+            f"{uncached * 1000:.2f} ms per render, {compiled * 1000:.2f} ms compiled",
+        )
+
+
+@tag("load")
+class RendererTests(TestCase):
+    """
+    Renders of a page of the users list with the orjson renderer and with
+    DRF's. Skip with ``--exclude-tag load``.
+    """
+
+    page_size = 1000
+    renders = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create(
+            User(
+                username=f"user{n}",
+                email=f"user{n}@example.com",
+                first_name="Ada",
+                last_name="Lovelace",
+                document_id=f"V{n}",
+            )
+            for n in range(cls.page_size)
+        )
+
+    def time_renders(self, renderer, data):
+        start = time.perf_counter()
+        for _ in range(self.renders):
+            renderer.render(data)
+        return (time.perf_counter() - start) / self.renders
+
+    def test_orjson_renderer(self):
+        users = User.objects.prefetch_related("groups", "user_permissions")
+        data = {"results": UserSerializer(users, many=True).data}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+        stock = self.time_renders(JSONRenderer(), data)
+        fast = self.time_renders(ORJSONRenderer(), data)
+        self.assertLess(
+            fast,
+            stock,
+            f"{stock * 1000:.2f} ms per page, {fast * 1000:.2f} ms with orjson",
+        )
+
+
+@tag("load")
+@override_settings(DATABASE_REPLICAS=[])
+@mock.patch.object(SlidingWindowThrottle, "THROTTLE_RATES", {})
+class AsyncViewsTests(TestCase):
+    """
+    Latency of profile reads sent along with logins, all in one event loop
+    like an ASGI worker. The sync views run one at a time on the thread of
+    the sync code, the reads wait for every login queued before them. The
+    async ones hash in the thread pool, the reads only share the cores with
+    the hashing. Skip with ``--exclude-tag load``.
+    """
+
+    logins = 8
+    reads = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("ada")
+
+    def tearDown(self):
+        activity.flush()
+
+    def get_read_latency(self):
+        client = AsyncClient()
+        token = RefreshToken.for_user(self.user).access_token
+
+        async def login():
+            response = await client.post(
+                "/token/",
+                {"username": "ada", "password": "secret"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 200, response.content)
+
+        async def read():
+            start = time.perf_counter()
+            # the async client takes header names, not WSGI environ keys
+            response = await client.get(
+                "/user/profile/", authorization=f"Bearer {token}"
+            )
+            self.assertEqual(response.status_code, 200, response.content)
+            return time.perf_counter() - start
+
+        @async_to_sync
+        async def run():
+            logins = [asyncio.ensure_future(login()) for _ in range(self.logins)]
+            # the logins are under way
+            await asyncio.sleep(0.05)
+            latencies = await asyncio.gather(*(read() for _ in range(self.reads)))
+            await asyncio.gather(*logins)
+            return latencies
+
+        return statistics.median(run())
+
+    def test_reads_are_not_blocked_by_logins(self):
+        sync = self.get_read_latency()
+        with override_settings(ROOT_URLCONF=__name__):
+            concurrent = self.get_read_latency()
+        self.assertLess(
+            concurrent,
+            sync,
+            f"median read {sync * 1000:.0f} ms with the sync views, "
+            f"{concurrent * 1000:.0f} ms with the async ones",
+        )
+
+
+# outside of a test case transaction, like a request in autocommit
+@override_settings(ROOT_URLCONF=__name__, DATABASE_REPLICAS=[])
+class AsyncSendOTPTests(TransactionTestCase):
+    def setUp(self):
+        simple_mailer.save_mails()
+        self.user = create_user("ada")
+        EmailDevice.objects.create(user=self.user, name="email", confirmed=True)
+
+    def tearDown(self):
+        activity.flush()
+
+    def test_challenge_is_sent(self):
+        client = AsyncClient()
+        token = RefreshToken.for_user(self.user).access_token
+
+        @async_to_sync
+        async def post():
+            return await client.post(
+                "/user/generate-otp/",
+                {},
+                content_type="application/json",
+                authorization=f"Bearer {token}",
+            )
+
+        response = post()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(MailOutbox.objects.get().to, ["ada@example.com"])
+
+
+@override_settings(
+    DATABASE_REPLICAS=[],
+    MAIL_OUTBOX_MAX_ATTEMPTS=3,
+    MAIL_OUTBOX_RETRY_DELAY=30,
+    MAIL_OUTBOX_CLAIM_TIMEOUT=300,
+)
+class SendOutboxTests(TransactionTestCase):
+    def setUp(self):
+        self.mail = MailOutbox.objects.create(
+            to=["ada@example.com"], subject="Hi", body="Hello"
+        )
+
+    def send_outbox(self):
+        call_command(
+            "send_outbox", "--once", stdout=io.StringIO(), stderr=io.StringIO()
+        )
+        self.mail.refresh_from_db()
+
+    def test_claimed_mails_are_skipped_by_other_workers(self):
+        command = send_outbox.Command()
+        before = timezone.now()
+        self.assertEqual(command.claim(10), [self.mail])
+        self.assertEqual(command.claim(10), [])
+
+        self.mail.refresh_from_db()
+        self.assertEqual(self.mail.status, MailOutbox.STATUS.PENDING)
+        self.assertGreaterEqual(
+            self.mail.next_attempt_at, before + timedelta(seconds=300)
+        )
+
+    def test_mails_are_sent_outside_of_a_transaction(self):
+        in_atomic_block = []
+
+        def send_messages(messages):
+            in_atomic_block.append(connection.in_atomic_block)
+            return len(messages)
+
+        with mock.patch.object(send_outbox, "get_connection") as get_connection:
+            get_connection.return_value.send_messages.side_effect = send_messages
+            self.send_outbox()
+
+        self.assertEqual(in_atomic_block, [False])
+        self.assertEqual(self.mail.status, MailOutbox.STATUS.SENT)
+        self.assertEqual(self.mail.attempts, 1)
+        self.assertIsNotNone(self.mail.sent_at)
+
+    def test_sent_mail(self):
+        self.send_outbox()
+        self.assertEqual(len(django_mail.outbox), 1)
+        self.assertEqual(django_mail.outbox[0].to, ["ada@example.com"])
+        self.assertEqual(self.mail.status, MailOutbox.STATUS.SENT)
+
+    def test_failures_back_off_then_fail(self):
+        with mock.patch.object(send_outbox, "get_connection") as get_connection:
+            get_connection.return_value.send_messages.side_effect = OSError("down")
+            for attempts, delay in [(1, 30), (2, 60)]:
+                before = timezone.now()
+                self.send_outbox()
+                self.assertEqual(self.mail.status, MailOutbox.STATUS.PENDING)
+                self.assertEqual(self.mail.attempts, attempts)
+                self.assertEqual(self.mail.last_error, "down")
+                self.assertGreaterEqual(
+                    self.mail.next_attempt_at, before + timedelta(seconds=delay)
+                )
+                self.assertLess(
+                    self.mail.next_attempt_at, before + timedelta(seconds=delay + 5)
+                )
+                # not due yet
+                self.send_outbox()
+                self.assertEqual(self.mail.attempts, attempts)
+                MailOutbox.objects.update(next_attempt_at=timezone.now())
+
+            self.send_outbox()
+
+        self.assertEqual(self.mail.status, MailOutbox.STATUS.FAILED)
+        self.assertEqual(self.mail.attempts, 3)
+
+    @override_settings(MAIL_OUTBOX_KEEP_SENT_DAYS=7)
+    def test_old_sent_mails_are_deleted(self):
+        now = timezone.now()
+        sent = MailOutbox.STATUS.SENT
+        old = MailOutbox.objects.create(
+            subject="old", status=sent, sent_at=now - timedelta(days=8)
+        )
+        recent = MailOutbox.objects.create(
+            subject="recent", status=sent, sent_at=now - timedelta(days=1)
+        )
+        failed = MailOutbox.objects.create(
+            subject="failed",
+            status=MailOutbox.STATUS.FAILED,
+            next_attempt_at=now - timedelta(days=30),
+        )
+
+        self.send_outbox()
+
+        self.assertQuerysetEqual(
+            MailOutbox.objects.order_by("pk"),
+            [self.mail, recent, failed],
+        )
+        self.assertFalse(MailOutbox.objects.filter(pk=old.pk).exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class LogoutAllTests(TestCase):
+    def setUp(self):
+        self.user = create_user("ada")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        activity.flush()
+        blacklist.blacklist_filter.bloom = None
+        blacklist.blacklist_filter.expire()
+
+    def logout_all(self):
+        tokens = [UserRefreshToken.for_user(self.user) for _ in range(3)]
+        other = UserRefreshToken.for_user(create_user("grace"))
+        expired = UserRefreshToken.for_user(self.user)
+        OutstandingToken.objects.filter(jti=expired["jti"]).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        # the filter loaded before the logout
+        self.assertFalse(blacklist.is_blacklisted(tokens[0]["jti"]))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/user/logout-all/")
+        self.assertEqual(response.json()["revoked"], 3)
+        self.assertEqual(
+            [q["sql"].split()[0] for q in queries if "SAVEPOINT" not in q["sql"]],
+            ["INSERT"],
+        )
+        # not the expired one
+        self.assertEqual(
+            set(BlacklistedToken.objects.values_list("token__jti", flat=True)),
+            {token["jti"] for token in tokens},
+        )
+
+        for token, status_code in [*((token, 401) for token in tokens), (other, 200)]:
+            response = self.client.post(
+                "/token/refresh/", {"refresh": str(token)}, format="json"
+            )
+            self.assertEqual(response.status_code, status_code)
+
+    def test_revokes_every_refresh_token(self):
+        self.logout_all()
+
+    @override_settings(TOKEN_BLACKLIST_FILTER=True)
+    def test_revokes_every_refresh_token_with_the_filter(self):
+        self.logout_all()
+
+
+class BlacklistFilterTests(TestCase):
+    def blacklist(self, user, age=0):
+        token = RefreshToken.for_user(user)
+        row, _ = token.blacklist()
+        if age:
+            row.blacklisted_at = timezone.now() - timedelta(seconds=age)
+            row.save()
+        return token["jti"], row
+
+    def test_loads_after_a_build_skip_the_committed_rows(self):
+        user = create_user("ada")
+        old_jti, old = self.blacklist(user, age=3600)
+        recent_jti, _ = self.blacklist(user)
+
+        blacklist_filter = BlacklistFilter()
+        now = time.monotonic()
+        blacklist_filter.load(now)
+        self.assertIn(old_jti, blacklist_filter.bloom)
+        self.assertIn(recent_jti, blacklist_filter.bloom)
+        # only the rows within the overlap are loaded again
+        self.assertEqual(blacklist_filter.since_id, old.id)
+
+        new_jti, _ = self.blacklist(user)
+        with CaptureQueriesContext(connection) as queries:
+            blacklist_filter.load(now + 1)
+        self.assertIn(f'"id" > {old.id}', queries[0]["sql"])
+        self.assertIn(new_jti, blacklist_filter.bloom)
+        self.assertEqual(blacklist_filter.since_id, old.id)
+        self.assertEqual(
+            BlacklistedToken.objects.filter(id__gt=blacklist_filter.since_id).count(),
+            2,
+        )
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class PruneTokensTests(TestCase):
+    def setUp(self):
+        self.user = create_user("ada")
+
+    def create_token(self, expired=False, blacklisted=False):
+        token = RefreshToken.for_user(self.user)
+        if expired:
+            OutstandingToken.objects.filter(jti=token["jti"]).update(
+                expires_at=timezone.now() - timedelta(seconds=1)
+            )
+        if blacklisted:
+            token.blacklist()
+        return token["jti"]
+
+    def prune(self):
+        stdout = io.StringIO()
+        call_command("prune_tokens", "--chunk-size", "2", stdout=stdout)
+        return stdout.getvalue()
+
+    def test_prunes_the_expired_tokens(self):
+        for _ in range(2):
+            self.create_token(expired=True)
+            self.create_token(expired=True, blacklisted=True)
+        kept = {self.create_token(), self.create_token(blacklisted=True)}
+
+        self.assertEqual(self.prune(), "Deleted 4 expired tokens (2 blacklisted)\n")
+        self.assertEqual(
+            set(OutstandingToken.objects.values_list("jti", flat=True)), kept
+        )
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+    def test_no_false_negative_after_pruning(self):
+        for _ in range(3):
+            self.create_token(expired=True, blacklisted=True)
+        blacklisted = [self.create_token(blacklisted=True) for _ in range(3)]
+
+        blacklist_filter = BlacklistFilter()
+        now = time.monotonic()
+        blacklist_filter.load(now)
+        self.prune()
+        blacklisted.append(self.create_token(blacklisted=True))
+
+        # loading the new rows, and building again
+        blacklist_filter.load(now + 1)
+        rebuilt = BlacklistFilter()
+        rebuilt.load(now + 1)
+        for jti in blacklisted:
+            self.assertIn(jti, blacklist_filter.bloom)
+            self.assertIn(jti, rebuilt.bloom)
+
+
+@tag("load")
+class ConnectionReuseTests(TestCase):
+    """
+    Latency of a request's query on a connection opened for it, as without
+    CONN_MAX_AGE, and on a persistent one checked with `SELECT 1` first.
+    Skip with ``--exclude-tag load``.
+    """
+
+    requests = 50
+
+    def measure(self, max_age):
+        primary = connections[DEFAULT_DB_ALIAS]
+        settings_dict = {**primary.settings_dict, "CONN_MAX_AGE": max_age}
+        wrapper = type(primary)(settings_dict, DEFAULT_DB_ALIAS)
+        opened = metrics.get_stats().get(DEFAULT_DB_ALIAS, {}).get("opened", 0)
+        latencies = []
+        try:
+            for _ in range(self.requests):
+                start = time.perf_counter()
+                # as the request_started and request_finished signals do
+                wrapper.close_if_unusable_or_obsolete()
+                with wrapper.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                wrapper.close_if_unusable_or_obsolete()
+                latencies.append(time.perf_counter() - start)
+        finally:
+            wrapper.close()
+        opened = metrics.get_stats()[DEFAULT_DB_ALIAS]["opened"] - opened
+        return statistics.median(latencies), opened
+
+    def test_persistent_connections_are_faster(self):
+        fresh, fresh_opened = self.measure(0)
+        persistent, persistent_opened = self.measure(60)
+        self.assertEqual(fresh_opened, self.requests)
+        self.assertEqual(persistent_opened, 1)
+        self.assertLess(
+            persistent,
+            fresh,
+            f"median {fresh * 1000:.2f} ms with a new connection, "
+            f"{persistent * 1000:.2f} ms reused",
+        )
+
+
+class SMTPCounter:
+    """aiosmtpd handler counting the sessions and the messages"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.messages = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        self.sessions += 1
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return "250 OK"
+
+
+@tag("load")
+@skipUnless(Controller, "aiosmtpd is not installed")
+class PooledEmailBackendTests(SimpleTestCase):
+    """
+    Sends per second to a local aiosmtpd server, one backend per message as
+    `send_mail` does, with and without the pool. Over the loopback without
+    TLS nor AUTH, the gain is a lower bound. Skip with ``--exclude-tag load``.
+    """
+
+    messages = 200
+
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.handler = SMTPCounter()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=port)
+        self.controller.start()
+        self.options = {
+            "host": "127.0.0.1",
+            "port": port,
+            "username": "",
+            "password": "",
+            "use_tls": False,
+        }
+
+    def tearDown(self):
+        get_pool(PooledEmailBackend(**self.options)).clear()
+        self.controller.stop()
+
+    def get_rate(self, backend_class):
+        start = time.perf_counter()
+        for n in range(self.messages):
+            message = EmailMessage(
+                "Subject", "Body", "from@example.com", [f"to{n}@example.com"]
+            )
+            backend_class(**self.options).send_messages([message])
+        return self.messages / (time.perf_counter() - start)
+
+    def test_pooled_sends_per_second(self):
+        unpooled = self.get_rate(EmailBackend)
+        self.assertEqual(self.handler.sessions, self.messages)
+
+        pooled = self.get_rate(PooledEmailBackend)
+        # a connection is recycled after EMAIL_POOL_MAX_MESSAGES
+        sessions = -(-self.messages // settings.EMAIL_POOL_MAX_MESSAGES)
+        self.assertEqual(self.handler.sessions, self.messages + sessions)
+        self.assertEqual(self.handler.messages, 2 * self.messages)
+        self.assertGreater(
+            pooled,
+            unpooled,
+            f"{unpooled:.0f} sends/s with a connection each, {pooled:.0f} pooled",
+        )
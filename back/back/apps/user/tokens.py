@@ -0,0 +1,141 @@
+"""
+JWT carrying the user fields that requests need, so the authentication can
+build `request.user` from the access token alone (`ClaimsUser`, see
+`authentication.ClaimsJWTAuthentication`) instead of querying the user.
+
+The claims are only added with USER_TOKEN_CLAIMS. They are as stale as the
+access token is old (ACCESS_TOKEN_LIFETIME), each refresh reloads them.
+"""
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from . import blacklist
+from .models import User
+
+USER_CLAIM = "user"
+
+CLAIM_FIELDS = (
+    "username",
+    "email",
+    "first_name",
+    "last_name",
+    "document_id",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+    "version",
+)
+
+
+def get_user_claims(user):
+    return {field: getattr(user, field) for field in CLAIM_FIELDS}
+
+
+class UserRefreshToken(RefreshToken):
+    """
+    Refresh token whose access tokens carry the claims of `user`, set by
+    `for_user` or by the refresh serializer. Its blacklist checks go through
+    the filter of `back.apps.user.blacklist`.
+    """
+
+    user = None
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.user = user
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        if settings.USER_TOKEN_CLAIMS and self.user is not None:
+            access[USER_CLAIM] = get_user_claims(self.user)
+        return access
+
+    def check_blacklist(self):
+        if blacklist.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist.blacklisted(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+    def rotate(self):
+        """
+        Turn this token into a new one (new jti and expiration), outstanding
+        like those of `for_user` so `revoke_user_tokens` reaches it
+        """
+        self.set_jti()
+        self.set_exp()
+        OutstandingToken.objects.create(
+            user_id=self[api_settings.USER_ID_CLAIM],
+            jti=self[api_settings.JTI_CLAIM],
+            token=str(self),
+            created_at=self.current_time,
+            expires_at=datetime_from_epoch(self["exp"]),
+        )
+
+
+class ClaimsUser:
+    """
+    Stand-in for the `User` of an access token: the claimed fields are read
+    from the token, anything else (or any write) loads the user.
+    """
+
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, user_id, claims):
+        object.__setattr__(self, "_claims", {**claims, "pk": user_id, "id": user_id})
+        object.__setattr__(self, "_user", None)
+
+    def get_user(self):
+        if self._user is None:
+            user = User._default_manager.get_cached(self._claims["pk"])
+            if user is None:
+                raise User.DoesNotExist("User matching query does not exist.")
+            object.__setattr__(self, "_user", user)
+        return self._user
+
+    def __getattr__(self, name):
+        # only called for what is not on the instance or its class
+        if name.startswith("__") or name in ("_claims", "_user"):
+            raise AttributeError(name)
+        if name in self._claims:
+            return self._claims[name]
+        return getattr(self.get_user(), name)
+
+    def __setattr__(self, name, value):
+        self._claims.pop(name, None)
+        setattr(self.get_user(), name, value)
+
+    def __eq__(self, other):
+        if isinstance(other, (ClaimsUser, User)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.username
+
+
+def get_claims_user(validated_token):
+    """The `ClaimsUser` of `validated_token`, None if it has no claims"""
+    claims = validated_token.get(USER_CLAIM)
+    if claims is None:
+        return None
+    return ClaimsUser(validated_token[api_settings.USER_ID_CLAIM], claims)
+
+
+def get_model_user(user):
+    """The `User` behind `user`, for the ORM (filters, relations)"""
+    return user.get_user() if isinstance(user, ClaimsUser) else user
@@ -1,11 +1,10 @@
+from django.conf import settings
 from django.urls.conf import path, include
 from rest_framework import routers
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-    TokenVerifyView,
-)
-from . import views
+from . import async_views, views
+
+# async variants of the hot endpoints, for ASGI serving
+ASYNC_VIEWS = settings.USER_ASYNC_VIEWS
 
 router = routers.DefaultRouter()
 router.register(
@@ -16,12 +15,12 @@ router.register(
 user_urls = [
     path(
         "register/",
-        views.RegistrationView.as_view(),
+        async_views.register if ASYNC_VIEWS else views.RegistrationView.as_view(),
         name="register",
     ),
     path(
         "profile/",
-        views.ProfileView.as_view(),
+        async_views.profile if ASYNC_VIEWS else views.ProfileView.as_view(),
         name="profile",
     ),
     path(
@@ -44,9 +43,14 @@ user_urls = [
         views.ChangeEmailView.as_view(),
         name="change-email",
     ),
+    path(
+        "logout-all/",
+        views.LogoutAllView.as_view(),
+        name="logout-all",
+    ),
     path(
         "generate-otp/",
-        views.SendOTPView.as_view(),
+        async_views.send_otp if ASYNC_VIEWS else views.SendOTPView.as_view(),
         name="generate-otp",
     ),
 ]
@@ -54,17 +58,17 @@ user_urls = [
 auth_urls = [
     path(
         "",
-        TokenObtainPairView.as_view(),
+        async_views.token_obtain_pair if ASYNC_VIEWS else views.TokenObtainPairView.as_view(),
         name="token_obtain_pair",
     ),
     path(
         "refresh/",
-        TokenRefreshView.as_view(),
+        async_views.token_refresh if ASYNC_VIEWS else views.TokenRefreshView.as_view(),
         name="token_refresh",
     ),
     path(
         "verify/",
-        TokenVerifyView.as_view(),
+        async_views.token_verify if ASYNC_VIEWS else views.TokenVerifyView.as_view(),
         name="token_verify",
     ),
 ]
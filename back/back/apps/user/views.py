@@ -1,21 +1,36 @@
+import csv
+import tempfile
 from datetime import timedelta
 
+import orjson
+
 from rest_framework import generics, serializers, viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError as APIValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
-from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.renderers import BrowsableAPIRenderer
 
 from django.conf import settings
+from django.db import connections, transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
 from django.contrib.auth.tokens import default_token_generator
 from django.core.exceptions import ValidationError
 from django.utils.http import urlsafe_base64_decode
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
-from drf_spectacular.utils import extend_schema, inline_serializer
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, inline_serializer
 
+from django_filters.rest_framework import DjangoFilterBackend
 from django_otp import devices_for_user
 from rest_framework.views import APIView
+from rest_framework_simplejwt.views import TokenObtainPairView as BaseTokenObtainPairView
+from rest_framework_simplejwt.views import TokenRefreshView as BaseTokenRefreshView
+from rest_framework_simplejwt.views import TokenVerifyView as BaseTokenVerifyView
 
 from .serializers import (
     UserSerializer,
@@ -26,12 +41,55 @@ from .serializers import (
     ChangePasswordSerializer,
     ChangeEmailSerializer,
     RegisterUserSerializer,
+    UserTokenObtainPairSerializer,
+    UserTokenRefreshSerializer,
+    UserBulkCreateSerializer,
+    UserBulkSelectionSerializer,
+    UserBulkUpdateSerializer,
 )
 
+from back.core.conditional import ConditionalMixin
+from back.core.mixins import SerializerQuerysetMixin, SparseFieldsetMixin
+from back.core.pagination import KeysetPagination
+from back.core.renderers import ORJSONRenderer
+from back.core.throttling import EmailThrottle, IPThrottle, UsernameThrottle
+from back.core.transactions import AUTOCOMMIT, transaction_policy
+
 from .models import User
+from .search import UserSearchFilter
+from .tokens import get_model_user
+from . import blacklist, bulk, cache, mails
+
+
+class EchoBuffer:
+    """File-like object returning what is written, for streaming csv"""
+
+    def write(self, value):
+        return value
+
+
+def spool(chunks):
+    """
+    A file holding `chunks`, in memory up to USER_EXPORT_SPOOL_SIZE bytes and
+    on disk past it
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=settings.USER_EXPORT_SPOOL_SIZE)
+    for chunk in chunks:
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserPagination(KeysetPagination):
+    ordering = ("-date_joined", "-id")
+
+
+class UserViewSet(
+    ConditionalMixin,
+    SparseFieldsetMixin,
+    SerializerQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     """
     Entrypoint for users
     """
@@ -39,24 +97,297 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAdminUser,)
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = UserPagination
+    filter_backends = (UserSearchFilter, OrderingFilter, DjangoFilterBackend)
+    ordering_fields = ("date_joined", "id", "username", "email")
+    ordering = ("-date_joined", "-id")
+    etag_fields = ("pk", "version", "last_login", "last_seen")
+    export_fields = (
+        "id",
+        "username",
+        "email",
+        "first_name",
+        "last_name",
+        "document_id",
+        "is_active",
+        "is_staff",
+        "is_superuser",
+        "date_joined",
+        "last_login",
+        "last_seen",
+    )
+    export_formats = {
+        "ndjson": "application/x-ndjson",
+        "csv": "text/csv",
+    }
+
+    def get_export_rows(self, queryset, fields, export_format):
+        """
+        Encoded rows in batches of USER_EXPORT_CHUNK_SIZE, memory stays flat
+        whatever the table size.
+        """
+
+        if export_format == "csv":
+            writer = csv.writer(EchoBuffer())
+
+            def encode(row):
+                row = [v.isoformat() if hasattr(v, "isoformat") else v for v in row]
+                return writer.writerow(row).encode()
+
+            yield encode(fields)
+        else:
+
+            def encode(row):
+                return orjson.dumps(dict(zip(fields, row))) + b"\n"
+
+        if connections[queryset.db].settings_dict.get("DISABLE_SERVER_SIDE_CURSORS"):
+            batches = self.get_export_pages(queryset, fields)
+        else:
+            batches = self.get_export_batches(queryset, fields)
+        for batch in batches:
+            yield b"".join(encode(row) for row in batch)
+
+    def get_export_batches(self, queryset, fields):
+        """
+        Rows read through a server-side cursor, inside a transaction: opened
+        in autocommit the cursor is WITH HOLD, and the server materializes
+        the whole result before the first row
+        """
+        chunk_size = settings.USER_EXPORT_CHUNK_SIZE
+        with transaction.atomic(using=queryset.db):
+            batch = []
+            for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+                batch.append(row)
+                if len(batch) >= chunk_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def get_export_pages(self, queryset, fields):
+        """
+        Rows read by pages over the pk, in pk order, when server-side cursors
+        are disabled (DATABASE_POOLER): a cursor can not outlive its query
+        """
+        chunk_size = settings.USER_EXPORT_CHUNK_SIZE
+        queryset = queryset.order_by("pk").values_list("pk", *fields)
+        last_pk = None
+        while True:
+            page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            rows = list(page[:chunk_size])
+            if not rows:
+                return
+            last_pk = rows[-1][0]
+            yield [row[1:] for row in rows]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "export_format",
+                enum=["ndjson", "csv"],
+                description=_("Output format, ndjson by default"),
+            ),
+        ],
+        responses={200: OpenApiTypes.STR},
+    )
+    @action(detail=False, methods=["get"])
+    def export(self, request, *args, **kwargs):
+        """
+        Stream every user matching the list filters, search and ordering
+        """
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in self.export_formats:
+            raise APIValidationError(
+                {"export_format": [_("Choose one of: ndjson, csv.")]}
+            )
+
+        requested = self.get_query_param_list(self.fields_query_param)
+        fields = [
+            field
+            for field in self.export_fields
+            if requested is None or field in requested
+        ]
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        # the rows are streamed after the request routing is over
+        queryset = queryset.using(queryset.db)
+
+        rows = self.get_export_rows(queryset, fields, export_format)
+        content_type = self.export_formats[export_format]
+        if isinstance(request._request, ASGIRequest):
+            # Django 4.0 iterates streaming responses in the event loop, where
+            # the queries are not allowed: the rows are read here instead
+            response = FileResponse(spool(rows), content_type=content_type)
+        else:
+            response = StreamingHttpResponse(rows, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="users.{export_format}"'
+        return response
+
+    def get_bulk_user_ids(self, selection):
+        """
+        Ids of the selected users that exist, and per id errors for the
+        others
+        """
+        if selection["all_matching"]:
+            queryset = self.filter_queryset(User.objects.all())
+            return list(queryset.order_by("pk").values_list("pk", flat=True)), {}
+
+        ids = list(dict.fromkeys(selection["ids"]))
+        existing = set(User.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        errors = {pk: [_("Not found.")] for pk in ids if pk not in existing}
+        return [pk for pk in ids if pk in existing], errors
+
+    def perform_bulk_update(self, selection, data):
+        user_ids, errors = self.get_bulk_user_ids(selection)
+
+        user = self.request.user
+        if user.pk in user_ids and False in (data.get("is_active"), data.get("is_staff")):
+            user_ids.remove(user.pk)
+            errors[user.pk] = [_("You cannot remove your own access.")]
+
+        updated = bulk.update_users(user_ids, data)
+        return Response({"updated": updated, "errors": errors})
+
+    @extend_schema(
+        responses=inline_serializer(
+            "bulk_update",
+            {
+                "updated": serializers.IntegerField(),
+                "errors": serializers.DictField(
+                    child=serializers.ListField(child=serializers.CharField())
+                ),
+            },
+        ),
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk-update",
+        serializer_class=UserBulkUpdateSerializer,
+    )
+    def bulk_update(self, request, *args, **kwargs):
+        """
+        Set the same fields on many users, selected by ids or by the list
+        filters with `all_matching`
+        """
+        serializer = UserBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        return self.perform_bulk_update(data, data["data"])
+
+    @extend_schema(
+        responses=inline_serializer(
+            "bulk_deactivate",
+            {
+                "updated": serializers.IntegerField(),
+                "errors": serializers.DictField(
+                    child=serializers.ListField(child=serializers.CharField())
+                ),
+            },
+        ),
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk-deactivate",
+        serializer_class=UserBulkSelectionSerializer,
+    )
+    def bulk_deactivate(self, request, *args, **kwargs):
+        """
+        Deactivate many users, selected by ids or by the list filters with
+        `all_matching`
+        """
+        serializer = UserBulkSelectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return self.perform_bulk_update(serializer.validated_data, {"is_active": False})
+
+    @extend_schema(
+        request=UserBulkCreateSerializer(many=True),
+        responses=inline_serializer(
+            "bulk_create",
+            {
+                "created": serializers.ListField(
+                    child=serializers.DictField(child=serializers.IntegerField())
+                ),
+                "errors": serializers.DictField(child=serializers.DictField()),
+            },
+        ),
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk-create",
+        serializer_class=UserBulkCreateSerializer,
+    )
+    def bulk_create(self, request, *args, **kwargs):
+        """
+        Create many users, valid rows are created and the others reported
+        by their index
+        """
+        if not isinstance(request.data, list) or not request.data:
+            raise APIValidationError(
+                {"non_field_errors": [_("Expected a non empty list of users.")]}
+            )
+        # each password is hashed within the request
+        max_rows = settings.USER_BULK_CREATE_MAX_ROWS
+        if len(request.data) > max_rows:
+            raise APIValidationError(
+                {
+                    "non_field_errors": [
+                        _("At most {max_rows} users at once.").format(max_rows=max_rows)
+                    ]
+                }
+            )
+
+        rows, errors = [], {}
+        for index, item in enumerate(request.data):
+            serializer = UserBulkCreateSerializer(data=item)
+            if serializer.is_valid():
+                rows.append((index, serializer.validated_data))
+            else:
+                errors[index] = serializer.errors
+
+        conflicts = bulk.get_unique_conflicts(rows)
+        errors.update(conflicts)
+        rows = [(index, data) for index, data in rows if index not in conflicts]
+
+        users, conflicts = bulk.create_users(rows)
+        errors.update(conflicts)
+        created = [{"index": index, "id": user.pk} for index, user in users]
+        return Response(
+            {"created": created, "errors": errors},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+        )
 
 
-class ProfileView(generics.RetrieveAPIView):
+class ProfileView(ConditionalMixin, SparseFieldsetMixin, generics.RetrieveAPIView):
     """
     Get data for current user
     """
 
-    renderer_classes = [JSONRenderer, BrowsableAPIRenderer]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
     serializer_class = UserProfileSerializer
     permission_classes = (IsAuthenticated,)
+    etag_fields = ("pk", "version")
 
     def get_object(self):
         return self.request.user
 
+    def get_retrieve_data(self, instance):
+        serializer = self.get_serializer(instance)
+        # the fields rendered, however `?fields=` / `?omit=` spelled them
+        variant = ",".join(sorted(serializer.fields))
+        data = cache.get_profile(instance, variant)
+        if data is None:
+            data = serializer.data
+            cache.set_profile(instance, variant, dict(data))
+        return data
+
 
 class PasswordResetView(generics.GenericAPIView):
     token_generator = default_token_generator
     serializer_class = PasswordResetSerializer
+    throttle_scope = "password_reset"
+    throttle_classes = (IPThrottle, EmailThrottle)
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=self.request.data)
@@ -80,17 +411,16 @@ class PasswordResetConfirmView(generics.GenericAPIView):
         try:
             # urlsafe_base64_decode() decodes to bytestring
             uid = urlsafe_base64_decode(self.kwargs["uidb64"]).decode()
-            user = User._default_manager.get(pk=uid)
+            user = User._default_manager.get_cached(uid)
         except (
             TypeError,
             ValueError,
             OverflowError,
-            User.DoesNotExist,
             ValidationError,
         ):
             return None
 
-        if not self.token_generator.check_token(user, self.kwargs["token"]):
+        if user is None or not self.token_generator.check_token(user, self.kwargs["token"]):
             return None
         return user
 
@@ -133,17 +463,24 @@ class SendOTPView(generics.GenericAPIView):
     serializer_class = OTPRequestSerializer
 
     def post(self, request, *args, **kwargs):
-        user = request.user
-
         serializer = self.get_serializer(data=self.request.data)
         serializer.is_valid(raise_exception=True)
 
-        data = serializer.data
-        devices = devices_for_user(user=user, confirmed=True, for_verify=True)
+        data, status_code = self.send_challenge(request.user, serializer.data)
+        return Response(data, status=status_code)
+
+    def send_challenge(self, user, data):
+        """
+        Generate and send an OTP to the device of `user`, return the
+        response data and status
+        """
+        devices = devices_for_user(
+            user=get_model_user(user), confirmed=True, for_verify=True
+        )
         if not devices:
-            return Response(
+            return (
                 {"message": _("Please contact customer service")},
-                status=status.HTTP_501_NOT_IMPLEMENTED,
+                status.HTTP_501_NOT_IMPLEMENTED,
             )
 
         device = next(devices)
@@ -163,7 +500,7 @@ class SendOTPView(generics.GenericAPIView):
 
         data["message"] = device.generate_challenge(extra_context)
 
-        return Response(data, status=status.HTTP_201_CREATED)
+        return data, status.HTTP_201_CREATED
 
 
 class ChangePasswordView(generics.GenericAPIView):
@@ -171,9 +508,11 @@ class ChangePasswordView(generics.GenericAPIView):
     Change password endpoint
     """
 
-    renderer_classes = [JSONRenderer, BrowsableAPIRenderer]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
     serializer_class = ChangePasswordSerializer
     permission_classes = (IsAuthenticated,)
+    throttle_scope = "password_change"
+    throttle_classes = (IPThrottle, UsernameThrottle)
 
     # drf-spectacular will not call get_serializer if is not overrided
     def get_serializer(self, *args, **kwargs):
@@ -191,7 +530,7 @@ class ChangeEmailView(generics.GenericAPIView):
     Change email endpoint
     """
 
-    renderer_classes = [JSONRenderer, BrowsableAPIRenderer]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
     serializer_class = ChangeEmailSerializer
     permission_classes = (IsAuthenticated,)
 
@@ -206,6 +545,32 @@ class ChangeEmailView(generics.GenericAPIView):
         return Response({"message": _("Your email have been successfully changed.")})
 
 
+class LogoutAllView(APIView):
+    """
+    Log out everywhere: revoke every refresh token of the current user, its
+    access tokens are still valid until they expire (ACCESS_TOKEN_LIFETIME)
+    """
+
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+    permission_classes = (IsAuthenticated,)
+
+    @extend_schema(
+        request=None,
+        responses=inline_serializer(
+            "logout_all",
+            {
+                "message": serializers.CharField(),
+                "revoked": serializers.IntegerField(),
+            },
+        ),
+    )
+    def post(self, request, *args, **kwargs):
+        revoked = blacklist.revoke_user_tokens(request.user.pk)
+        return Response(
+            {"message": _("You have been logged out everywhere."), "revoked": revoked}
+        )
+
+
 class RegistrationView(generics.GenericAPIView):
     """
     API for registering users
@@ -217,9 +582,16 @@ class RegistrationView(generics.GenericAPIView):
     """
 
     serializer_class = RegisterUserSerializer
+    success_message = _("You have successfully registered.")
+    throttle_scope = "register"
+    throttle_classes = (IPThrottle, EmailThrottle)
 
     def send_registration_email(self, user):
-        pass
+        mail = mails.WelcomeMail()
+        mail.set_context(user)
+        # written to the outbox in the transaction creating the user, or
+        # without the outbox sent after commit from a background thread
+        mail.send([user.email])
 
     def post(self, request, *args, **kwargs):
         ser = self.serializer_class(data=request.data)
@@ -230,6 +602,34 @@ class RegistrationView(generics.GenericAPIView):
         user = ser.save()
         self.send_registration_email(user)
         return Response(
-            {"message": _("You have successfully registered.")},
+            {"message": self.success_message},
             status=status.HTTP_201_CREATED,
         )
+
+
+class TokenObtainPairView(BaseTokenObtainPairView):
+    """
+    Takes a set of user credentials and returns an access and refresh JSON web
+    token pair to prove the authentication of those credentials.
+    """
+
+    serializer_class = UserTokenObtainPairSerializer
+    throttle_scope = "login"
+    throttle_classes = (IPThrottle, UsernameThrottle)
+
+
+class TokenRefreshView(BaseTokenRefreshView):
+    """
+    Takes a refresh type JSON web token and returns an access type JSON web
+    token if the refresh token is valid.
+    """
+
+    serializer_class = UserTokenRefreshSerializer
+
+
+@transaction_policy(AUTOCOMMIT)
+class TokenVerifyView(BaseTokenVerifyView):
+    """
+    Takes a token and indicates if it is valid.  This view provides no
+    information about a token's fitness for a particular use.
+    """
@@ -0,0 +1,137 @@
+"""
+Helpers for plain async Django views answering like the DRF ones.
+
+Django 4.0 has no async ORM and DRF 3.13 no async views, so these views do
+their database work through `sync_to_async` (thread sensitive, it shares the
+request connection) and push CPU bound work to the default thread pool with
+`thread_sensitive=False`, keeping the event loop free.
+"""
+from functools import wraps
+from types import SimpleNamespace
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .renderers import ORJSONRenderer
+
+
+def run_in_thread(func, *args, **kwargs):
+    """Await `func` in the thread pool, for CPU bound work without ORM"""
+    return sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+
+
+def render(data, status=status.HTTP_200_OK, headers=None):
+    response = HttpResponse(
+        ORJSONRenderer().render(data),
+        content_type=ORJSONRenderer.media_type,
+        status=status,
+    )
+    for header, value in (headers or {}).items():
+        response[header] = value
+    return response
+
+
+def parse(request):
+    """The JSON or form body of `request`"""
+    if request.content_type == "application/json":
+        if not request.body:
+            return {}
+        try:
+            return orjson.loads(request.body)
+        except orjson.JSONDecodeError as exc:
+            raise exceptions.ParseError("JSON parse error - %s" % str(exc))
+    return request.POST.dict()
+
+
+def handle_exception(exc, request, authenticator=None):
+    """`APIView.handle_exception` for the async views, same error bodies"""
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        # like APIView, the header comes from the first authentication class
+        if authenticator is None and api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            authenticator = api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]()
+        header = authenticator and authenticator.authenticate_header(request)
+        if header:
+            exc.auth_header = header
+        else:
+            exc.status_code = status.HTTP_403_FORBIDDEN
+
+    context = {"view": None, "args": (), "kwargs": {}, "request": request}
+    response = api_settings.EXCEPTION_HANDLER(exc, context)
+    if response is None:
+        raise exc
+    headers = {
+        header: value for header, value in response.items() if header != "Content-Type"
+    }
+    return render(response.data, status=response.status_code, headers=headers)
+
+
+def check_throttles(request, throttle_scope, throttle_classes):
+    """`APIView.check_throttles` for the async views"""
+    # read now, so the view can still parse it (see `parse`)
+    request.body
+    drf_request = Request(
+        request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]
+    )
+    view = SimpleNamespace(throttle_scope=throttle_scope)
+    durations = [
+        throttle.wait()
+        for throttle in (throttle_class() for throttle_class in throttle_classes)
+        if not throttle.allow_request(drf_request, view)
+    ]
+    if durations:
+        raise exceptions.Throttled(max(durations))
+
+
+def async_api_view(
+    methods=("GET",),
+    authentication_class=None,
+    throttle_scope=None,
+    throttle_classes=(),
+):
+    """
+    Turn an async function into an API view: method check, CSRF exemption
+    (like `APIView`), exceptions rendered by the EXCEPTION_HANDLER, with an
+    `authentication_class` an authenticated `request.user` and with
+    `throttle_classes` the throttles of `throttle_scope`.
+
+    The view never runs in a request transaction (Django cannot wrap async
+    views), writes must open their own.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            authenticator = authentication_class() if authentication_class else None
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+
+                if authenticator is not None:
+                    result = await sync_to_async(authenticator.authenticate)(request)
+                    if result is None:
+                        raise exceptions.NotAuthenticated()
+                    request.user, request.auth = result
+
+                if throttle_classes:
+                    # the throttles' cache may be over the network
+                    await sync_to_async(check_throttles)(
+                        request, throttle_scope, throttle_classes
+                    )
+
+                return await func(request, *args, **kwargs)
+            except Exception as exc:
+                response = handle_exception(exc, request, authenticator)
+                if isinstance(exc, exceptions.MethodNotAllowed):
+                    response["Allow"] = ", ".join(methods)
+                return response
+
+        view.csrf_exempt = True
+        return transaction.non_atomic_requests(view)
+
+    return decorator
+
@@ -0,0 +1,123 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import parse_etags
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = _("The resource has been modified.")
+    default_code = "precondition_failed"
+
+
+class ConditionalMixin:
+    """
+    Generic view mixin adding ETags to `retrieve`, `list` and `update`.
+
+    The ETag is computed from the `etag_fields` of the objects (a version
+    counter and the like) before any serialization happens, so
+    `If-None-Match` is answered with a 304 for the price of the query alone.
+    `If-Match` on PUT/PATCH gives optimistic concurrency (412 on mismatch).
+    """
+
+    etag_fields = ("pk",)
+
+    def hash(self, data):
+        value = json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"))
+        return hashlib.sha1(value.encode()).hexdigest()[:20]
+
+    def get_etag(self, objects, envelope=None):
+        """
+        `"<state>.<variant>"`, the state comes from the objects (and the
+        pagination `envelope` of a list) and the variant from the
+        representation (query string, media type).
+        """
+        state = self.hash(
+            [
+                [
+                    [getattr(obj, field) for field in self.etag_fields]
+                    for obj in objects
+                ],
+                envelope,
+            ]
+        )
+        variant = self.hash(
+            [
+                self.request.get_full_path(),
+                getattr(self.request, "accepted_media_type", ""),
+            ]
+        )
+        return f'"{state}.{variant}"'
+
+    def etag_matches(self, header, etag, weak=False):
+        """
+        None when the header is missing. With `weak` only the state part is
+        compared, any representation of the same state matches.
+        """
+        value = self.request.META.get(header)
+        if not value:
+            return None
+        etags = [tag[2:] if tag.startswith("W/") else tag for tag in parse_etags(value)]
+        if "*" in etags:
+            return True
+        if weak:
+            state = etag.strip('"').split(".")[0]
+            return any(tag.strip('"').split(".")[0] == state for tag in etags)
+        return etag in etags
+
+    def not_modified(self, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    def get_object(self):
+        obj = super().get_object()
+        if self.request.method in ("PUT", "PATCH"):
+            etag = self.get_etag([obj])
+            if self.etag_matches("HTTP_IF_MATCH", etag, weak=True) is False:
+                raise PreconditionFailed()
+            self.object = obj
+        return obj
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = self.get_etag([instance])
+        if self.etag_matches("HTTP_IF_NONE_MATCH", etag):
+            return self.not_modified(etag)
+
+        return Response(self.get_retrieve_data(instance), headers={"ETag": etag})
+
+    def get_retrieve_data(self, instance):
+        return self.get_serializer(instance).data
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        objects = list(queryset) if page is None else page
+
+        etag = self.get_etag(objects, self.get_pagination_envelope(page))
+        if self.etag_matches("HTTP_IF_NONE_MATCH", etag):
+            return self.not_modified(etag)
+
+        serializer = self.get_serializer(objects, many=True)
+        if page is None:
+            response = Response(serializer.data)
+        else:
+            response = self.get_paginated_response(serializer.data)
+        response["ETag"] = etag
+        return response
+
+    def get_pagination_envelope(self, page):
+        """The paginated response but the results (count, links, ...)"""
+        if page is None:
+            return None
+        data = self.paginator.get_paginated_response([]).data
+        return {key: value for key, value in data.items() if key != "results"}
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        response["ETag"] = self.get_etag([self.object])
+        return response
@@ -0,0 +1,35 @@
+"""
+Database connection counters of the current process (worker), per alias.
+
+Imported by the database backend, so it must not import DRF (the views
+import the authentication, hence the models), see `views` for the endpoint.
+"""
+import threading
+from collections import Counter, defaultdict
+
+_stats = defaultdict(Counter)
+_connect_seconds = defaultdict(float)
+_lock = threading.Lock()
+
+
+def count(alias, name):
+    with _lock:
+        _stats[alias][name] += 1
+
+
+def record_connect(alias, seconds):
+    with _lock:
+        _stats[alias]["opened"] += 1
+        _connect_seconds[alias] += seconds
+
+
+def get_stats():
+    with _lock:
+        return {
+            alias: {
+                **counters,
+                "connect_seconds": round(_connect_seconds[alias], 6),
+            }
+            for alias, counters in _stats.items()
+        }
+
@@ -0,0 +1,59 @@
+"""
+PostgreSQL backend adding health checks of persistent connections.
+
+With CONN_MAX_AGE a connection outlives its request, the server (or a
+pooler, a failover, ...) may have closed it meanwhile. When
+CONN_HEALTH_CHECKS is set, a reused connection is checked with `SELECT 1`
+before its first use in each request, and reopened if it is broken,
+instead of failing that request. (A backport of Django 4.1's option.)
+"""
+import time
+
+from django.db.backends.postgresql import base
+
+from .. import metrics
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get("CONN_HEALTH_CHECKS", False)
+
+    def connect(self):
+        start = time.monotonic()
+        # a new connection needs no check, set before connecting since
+        # connect() itself goes through ensure_connection() (set_autocommit)
+        self.health_check_done = True
+        super().connect()
+        metrics.record_connect(self.alias, time.monotonic() - start)
+
+    def _close(self):
+        if self.connection is not None:
+            metrics.count(self.alias, "closed")
+        super()._close()
+
+    def close_if_health_check_failed(self):
+        if (
+            self.connection is None
+            or not self.health_check_enabled
+            or self.health_check_done
+        ):
+            return
+
+        if not self.is_usable():
+            metrics.count(self.alias, "health_check_failures")
+            self.close()
+        self.health_check_done = True
+
+    def ensure_connection(self):
+        self.close_if_health_check_failed()
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        # called when a request starts and ends, the next use checks again
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
@@ -0,0 +1,22 @@
+import os
+
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .metrics import get_stats
+
+
+class DatabaseMetricsView(APIView):
+    """
+    Connection counters of the worker answering (opened, closed, failed
+    health checks and time spent connecting), per database
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    def get(self, request, *args, **kwargs):
+        return Response({"pid": os.getpid(), "databases": get_stats()})
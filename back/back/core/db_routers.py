@@ -0,0 +1,134 @@
+"""
+Read replicas for the request traffic.
+
+Requests with a safe method read from a replica (DATABASE_REPLICAS) until
+something writes: from then on the request is pinned to the primary, and
+so are the following requests of the same client (cookie) and user (cache)
+for REPLICA_STICKY_SECONDS, so they read their own writes despite the
+replication lag. Everything outside a request (commands, workers, ...)
+uses the primary.
+"""
+import asyncio
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_state = ContextVar("db_routing_state", default=None)
+
+
+def get_sticky_key(user_id):
+    return f"db:primary:{user_id}"
+
+
+class RoutingState:
+    def __init__(self, replicas, primary=False):
+        self.replicas = replicas
+        self.primary = primary
+        self.wrote = False
+
+
+def pin_primary():
+    """Send the rest of the current request to the primary"""
+    state = _state.get()
+    if state is not None:
+        state.primary = True
+
+
+def check_sticky(user_id):
+    """Pin the current request if `user_id` wrote recently (see `stick`)"""
+    state = _state.get()
+    if state is not None and not state.primary and cache.get(get_sticky_key(user_id)):
+        state.primary = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.primary or not state.replicas:
+            return DEFAULT_DB_ALIAS
+        return random.choice(state.replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.primary = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Set up the routing of each request, place it before any middleware that
+    may query the database.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = settings.REPLICA_STICKY_COOKIE_NAME
+        self.sticky_seconds = settings.REPLICA_STICKY_SECONDS
+        if asyncio.iscoroutinefunction(self.get_response):
+            # as Django's MiddlewareMixin, tells the handler to await __call__
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = self.get_state(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+            if state.wrote:
+                self.stick(request, response)
+        finally:
+            _state.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        # the sync code under it runs in copies of this context, sharing the
+        # state object
+        state = self.get_state(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+            if state.wrote:
+                # the user may still be lazy, loaded from the session
+                await sync_to_async(self.stick, thread_sensitive=True)(
+                    request, response
+                )
+        finally:
+            _state.reset(token)
+        return response
+
+    def get_state(self, request):
+        primary = request.method not in SAFE_METHODS or bool(
+            request.COOKIES.get(self.cookie_name)
+        )
+        return RoutingState(settings.DATABASE_REPLICAS, primary=primary)
+
+    def stick(self, request, response):
+        response.set_cookie(
+            self.cookie_name,
+            "1",
+            max_age=self.sticky_seconds,
+            httponly=True,
+            samesite="Lax",
+        )
+        # set by the authentication, for token clients without cookies
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            cache.set(get_sticky_key(user.pk), True, self.sticky_seconds)
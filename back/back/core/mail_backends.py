@@ -0,0 +1,163 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend
+
+
+class SMTPConnectionPool:
+    """
+    A bounded pool of authenticated SMTP connections shared by every backend
+    instance of the process.
+
+    Connections are checked with a NOOP before being handed out and are
+    dropped after `max_messages` messages or `idle_timeout` seconds idle.
+    """
+
+    def __init__(self, size, max_messages, idle_timeout, timeout=None):
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, connect):
+        """
+        Return a healthy pooled connection, `connect` is called to open a new
+        one when there is none idle.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("No SMTP connection available in the pool")
+
+        try:
+            while True:
+                with self._lock:
+                    pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    return PooledConnection(connect())
+                if self.is_usable(pooled):
+                    return pooled
+                pooled.quit()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, pooled, discard=False):
+        try:
+            if discard or pooled.sent >= self.max_messages:
+                pooled.quit()
+            else:
+                pooled.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(pooled)
+        finally:
+            self._slots.release()
+
+    def is_usable(self, pooled):
+        if time.monotonic() - pooled.last_used > self.idle_timeout:
+            return False
+        try:
+            return pooled.connection.noop()[0] == 250
+        except Exception:
+            return False
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.quit()
+
+
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def quit(self):
+        try:
+            self.connection.quit()
+        except Exception:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(backend):
+    """Return the pool of the process for the backend's server and account"""
+    key = (
+        backend.host,
+        backend.port,
+        backend.username,
+        backend.use_tls,
+        backend.use_ssl,
+    )
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SMTPConnectionPool(
+                size=settings.EMAIL_POOL_SIZE,
+                max_messages=settings.EMAIL_POOL_MAX_MESSAGES,
+                idle_timeout=settings.EMAIL_POOL_IDLE_TIMEOUT,
+                timeout=settings.EMAIL_POOL_TIMEOUT,
+            )
+        return _pools[key]
+
+
+class PooledEmailBackend(EmailBackend):
+    """
+    SMTP backend that borrows its connection from a per-process pool, so
+    many sends share the same TLS session and AUTH.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = get_pool(self)
+        self.pooled = None
+        self.broken = False
+
+    def connect(self):
+        super().open()
+        if self.connection is None:
+            raise ConnectionError(f"Could not connect to {self.host}:{self.port}")
+        return self.connection
+
+    def open(self):
+        if self.connection:
+            return False
+        try:
+            self.pooled = self.pool.acquire(self.connect)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            return False
+        self.connection = self.pooled.connection
+        self.broken = False
+        return True
+
+    def close(self):
+        if self.pooled is None:
+            return
+        try:
+            self.pool.release(self.pooled, discard=self.broken)
+        finally:
+            self.pooled = None
+            self.connection = None
+
+    def _send(self, email_message):
+        try:
+            sent = super()._send(email_message)
+        except Exception:
+            self.broken = True
+            raise
+        if sent:
+            self.pooled.sent += 1
+        elif email_message.recipients():
+            # fail_silently swallowed an SMTP error
+            self.broken = True
+        return sent
@@ -0,0 +1,231 @@
+"""
+OpenAPI schema generated once (`manage.py build_schema`) and served from disk.
+
+The build writes every format, plain and compressed, under
+`SCHEMA_ROOT/<version>/` where the version is a hash of the schema, plus a
+`manifest.json` naming the current version. The views below serve those
+bytes with strong ETags, the versioned URL is cached as immutable.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.plumbing import get_relative_url
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import (
+    SCHEMA_KWARGS,
+    SpectacularAPIView,
+    SpectacularRedocView,
+    SpectacularSwaggerView,
+)
+from rest_framework.exceptions import NotFound
+from rest_framework.reverse import reverse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+RENDERERS = {
+    "yaml": OpenApiYamlRenderer,
+    "json": OpenApiJsonRenderer,
+}
+
+# preferred first
+ENCODINGS = {
+    "br": ".br",
+    "gzip": ".gz",
+}
+
+_files = {}
+_manifest = None
+_lock = threading.Lock()
+
+
+def get_schema_root():
+    return Path(settings.SCHEMA_ROOT)
+
+
+def compress(content, encoding):
+    if encoding == "br":
+        return brotli.compress(content, quality=11)
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def build_schema(root=None):
+    """
+    Generate the schema, write its files and switch the manifest to it.
+    Return the manifest.
+    """
+    root = Path(root or get_schema_root())
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=True)
+
+    rendered = {name: renderer().render(schema) for name, renderer in RENDERERS.items()}
+    version = hashlib.sha256(rendered["yaml"]).hexdigest()[:16]
+    encodings = [name for name in ENCODINGS if name != "br" or brotli is not None]
+
+    directory = root / version
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, content in rendered.items():
+        (directory / f"schema.{name}").write_bytes(content)
+        for encoding in encodings:
+            path = directory / f"schema.{name}{ENCODINGS[encoding]}"
+            path.write_bytes(compress(content, encoding))
+
+    manifest = {"version": version, "encodings": encodings}
+    tmp = root / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, root / "manifest.json")
+
+    # drop the builds nobody points to anymore
+    for path in root.iterdir():
+        if path.is_dir() and path.name != version:
+            shutil.rmtree(path, ignore_errors=True)
+    return manifest
+
+
+def get_manifest():
+    """
+    The manifest of the current build, None when there is none. It is read
+    once per process, the schema is built before the server starts.
+    """
+    global _manifest
+    with _lock:
+        if _manifest is None:
+            try:
+                _manifest = json.loads((get_schema_root() / "manifest.json").read_text())
+            except (OSError, ValueError):
+                return None
+        return _manifest
+
+
+def get_schema_file(version, name, encoding=None):
+    key = (version, name, encoding)
+    with _lock:
+        if key not in _files:
+            suffix = ENCODINGS[encoding] if encoding else ""
+            path = get_schema_root() / version / f"schema.{name}{suffix}"
+            _files[key] = path.read_bytes()
+        return _files[key]
+
+
+def get_accepted_encodings(request):
+    accepted = set()
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        encoding, *params = [part.strip() for part in item.split(";")]
+        quality = next((param[2:] for param in params if param.startswith("q=")), "1")
+        try:
+            if float(quality) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(encoding.lower())
+    return accepted
+
+
+class PrebuiltSchemaView(SpectacularAPIView):
+    """
+    OpenApi3 schema for this API. Format can be selected via content negotiation.
+
+    - YAML: application/vnd.oai.openapi
+    - JSON: application/vnd.oai.openapi+json
+
+    Served from the `build_schema` files, generated live only in DEBUG.
+    """
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        manifest = get_manifest()
+        if manifest is None or (settings.USE_I18N and request.GET.get("lang")):
+            if settings.DEBUG:
+                return super().get(request, *args, **kwargs)
+            if manifest is None:
+                logger.error("The OpenAPI schema has not been built")
+                raise NotFound(_("The schema is not available."))
+
+        version = manifest["version"]
+        requested = kwargs.get("version")
+        if requested is not None and requested != version:
+            raise NotFound(_("Unknown schema version."))
+
+        name = request.accepted_renderer.format
+        accepted = get_accepted_encodings(request)
+        encoding = next(
+            (encoding for encoding in manifest["encodings"] if encoding in accepted),
+            None,
+        )
+
+        # strong ETag, one per representation
+        etag = f'"{version}.{name}.{encoding or "identity"}"'
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept, Accept-Encoding",
+            "Cache-Control": "public, max-age=31536000, immutable"
+            if requested
+            else "public, no-cache",
+        }
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                get_schema_file(version, name, encoding),
+                content_type=request.accepted_media_type,
+            )
+            if encoding:
+                headers["Content-Encoding"] = encoding
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+
+class PrebuiltSchemaVersionView(PrebuiltSchemaView):
+    """The schema at its versioned, immutable URL"""
+
+    @extend_schema(exclude=True)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class VersionedSchemaMixin:
+    """
+    Doc UI view mixin pointing the UI to the versioned (immutable) URL of
+    the prebuilt schema, named `version_url_name`
+    """
+
+    version_url_name = "schema-version"
+
+    # as the spectacular views, that this override hides
+    @extend_schema(exclude=True)
+    def get(self, request, *args, **kwargs):
+        manifest = get_manifest()
+        if manifest is not None and not request.GET.get("lang"):
+            self.url = get_relative_url(
+                reverse(
+                    self.version_url_name,
+                    kwargs={"version": manifest["version"]},
+                    request=request,
+                )
+            )
+        return super().get(request, *args, **kwargs)
+
+
+class PrebuiltSwaggerView(VersionedSchemaMixin, SpectacularSwaggerView):
+    pass
+
+
+class PrebuiltRedocView(VersionedSchemaMixin, SpectacularRedocView):
+    pass
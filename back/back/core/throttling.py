@@ -0,0 +1,142 @@
+"""
+Throttles of the endpoints that hash passwords or send mails.
+
+A view sets its `throttle_scope` and throttle classes, each class keys the
+requests on something else (client IP, username, email) and takes its rate
+from DEFAULT_THROTTLE_RATES["<scope>.<kind>"], scopes without a rate are
+not throttled.
+
+Rates are enforced over a sliding window approximated from two fixed
+windows: the count of the current window plus the previous one weighted by
+how much of it the sliding window still covers. Each check is one
+`get_many` and one `incr` on the cache whatever the rate, unlike DRF's
+throttles that store the timestamp of every request.
+"""
+import hashlib
+import math
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Requests of each client IP by default, subclasses count them by
+    something else with their own `kind` and `get_ident_value`
+    """
+
+    kind = "ip"
+    cache_format = "throttle:%(scope)s:%(ident)s"
+
+    def __init__(self):
+        # the scope comes from the view, see `allow_request`
+        self.cache = caches[settings.THROTTLE_CACHE_ALIAS]
+
+    def get_ident_value(self, request):
+        """The value the requests are counted by, None to let it through"""
+        return self.get_ident(request)
+
+    def get_cache_key(self, request, view):
+        value = self.get_ident_value(request)
+        if not value:
+            return None
+        ident = hashlib.md5(str(value).lower().encode()).hexdigest()
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+    def allow_request(self, request, view):
+        self.scope = f"{getattr(view, 'throttle_scope', None)}.{self.kind}"
+        self.rate = self.THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        key = f"{self.key}:{window}"
+        previous_key = f"{self.key}:{window - 1}"
+
+        counts = self.cache.get_many([key, previous_key])
+        self.current = counts.get(key, 0)
+        self.previous = counts.get(previous_key, 0)
+        self.elapsed = self.now - window * self.duration
+        if self.get_estimate() >= self.num_requests:
+            return self.throttle_failure()
+
+        # the window's key outlives the next window, where it is the previous
+        self.cache.add(key, 0, 2 * self.duration)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # expired in between
+            self.cache.set(key, 1, 2 * self.duration)
+        return self.throttle_success()
+
+    def get_estimate(self):
+        weight = 1 - self.elapsed / self.duration
+        return self.previous * weight + self.current
+
+    def throttle_success(self):
+        # counted already, no request history to keep
+        return True
+
+    def wait(self):
+        """Seconds until the estimate falls under the rate"""
+        if self.current < self.num_requests and self.previous:
+            # within the current window, while the previous one fades
+            wait = self.duration * (
+                1 - (self.num_requests - self.current) / self.previous
+            )
+            wait -= self.elapsed
+            if wait < self.duration - self.elapsed:
+                return max(math.ceil(wait), 1)
+        # in the next window, the current one fading in turn
+        wait = 2 * self.duration - self.elapsed
+        wait -= self.duration * self.num_requests / max(self.current, 1)
+        return max(math.ceil(max(wait, self.duration - self.elapsed)), 1)
+
+
+class IPThrottle(SlidingWindowThrottle):
+    """
+    Requests of each client IP, REMOTE_ADDR or the address NUM_PROXIES hops
+    from the end of X-Forwarded-For
+    """
+
+
+
+class UsernameThrottle(SlidingWindowThrottle):
+    """
+    Requests for each username, the one posted (login) or else the one of
+    the authenticated user
+    """
+
+    kind = "username"
+
+    def get_ident_value(self, request):
+        value = get_posted(request, get_user_model().USERNAME_FIELD)
+        if value:
+            return value
+        if request.user and request.user.is_authenticated:
+            return request.user.get_username()
+        return None
+
+
+class EmailThrottle(SlidingWindowThrottle):
+    """Requests for each posted email (registration, password reset)"""
+
+    kind = "email"
+
+    def get_ident_value(self, request):
+        return get_posted(request, "email")
+
+
+def get_posted(request, field):
+    """The string posted as `field`, None if there is none"""
+    data = request.data
+    value = data.get(field) if isinstance(data, dict) else None
+    return value if isinstance(value, str) else None
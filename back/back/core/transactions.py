@@ -0,0 +1,126 @@
+"""
+Per view transaction policy, instead of wrapping every request in a
+transaction with ATOMIC_REQUESTS.
+
+A view declares its policy with the `transaction_policy` attribute (or
+decorator), otherwise TRANSACTION_POLICY applies:
+
+- "atomic": the whole view runs in a transaction
+- "autocommit": no transaction, each query commits on its own
+- "writes": atomic for unsafe methods, autocommit for GET, HEAD, OPTIONS
+"""
+import asyncio
+import sys
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .db_routers import pin_primary
+
+ATOMIC = "atomic"
+AUTOCOMMIT = "autocommit"
+WRITES = "writes"
+
+POLICIES = (ATOMIC, AUTOCOMMIT, WRITES)
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# the request attribute holding the transaction of the view
+ATOMIC_ATTR = "_transaction_atomic"
+
+
+def transaction_policy(policy):
+    """Decorator setting the transaction policy of a view class or function"""
+    assert policy in POLICIES, f"Unknown transaction policy {policy!r}"
+
+    def decorator(view):
+        view.transaction_policy = policy
+        return view
+
+    return decorator
+
+
+def get_view_policy(view_func):
+    policy = getattr(view_func, "transaction_policy", None)
+    if policy is None:
+        # class based views, the DRF and the Django way
+        view_class = getattr(view_func, "cls", None) or getattr(
+            view_func, "view_class", None
+        )
+        policy = getattr(view_class, "transaction_policy", None)
+    if policy is None and DEFAULT_DB_ALIAS in getattr(
+        view_func, "_non_atomic_requests", ()
+    ):
+        policy = AUTOCOMMIT
+    return policy or settings.TRANSACTION_POLICY
+
+
+class TransactionPolicyMiddleware:
+    """
+    Run the view in a transaction of the default database when its policy
+    asks for one, rolled back if the response is an error (>= 400).
+
+    The transaction starts in `process_view` and ends once the middleware
+    after this one returned the response, place it last so it only spans
+    the view. Async views are left alone, Django cannot wrap them in a
+    transaction.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # as Django's MiddlewareMixin, tells the handler to await __call__
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.end_transaction(request, exc_info=sys.exc_info())
+            raise
+        return self.end_transaction(request, response)
+
+    async def __acall__(self, request):
+        # in the thread of the sync views, where `process_view` ran too
+        end_transaction = sync_to_async(self.end_transaction, thread_sensitive=True)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            if ATOMIC_ATTR in request.__dict__:
+                await end_transaction(request, exc_info=sys.exc_info())
+            raise
+        if ATOMIC_ATTR in request.__dict__:
+            response = await end_transaction(request, response)
+        return response
+
+    def is_atomic(self, request, view_func):
+        policy = get_view_policy(view_func)
+        if policy == WRITES:
+            return request.method not in SAFE_METHODS
+        return policy == ATOMIC
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if asyncio.iscoroutinefunction(view_func):
+            return None
+        if not self.is_atomic(request, view_func):
+            return None
+
+        # the reads of a transaction must see its writes
+        pin_primary()
+        atomic = transaction.atomic(using=DEFAULT_DB_ALIAS)
+        atomic.__enter__()
+        setattr(request, ATOMIC_ATTR, atomic)
+        return None
+
+    def end_transaction(self, request, response=None, exc_info=None):
+        atomic = request.__dict__.pop(ATOMIC_ATTR, None)
+        if atomic is not None:
+            if response is not None and response.status_code >= 400:
+                transaction.set_rollback(True, using=DEFAULT_DB_ALIAS)
+            atomic.__exit__(*(exc_info or (None, None, None)))
+        return response
@@ -46,7 +46,9 @@ ALLOWED_HOSTS = env.list("ALLOWED_HOSTS")
 SITE_ID = int(env("SITE_ID", default="1"))
 
 # Email settings
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_BACKEND = env(
+    "EMAIL_BACKEND", default="back.core.mail_backends.PooledEmailBackend"
+)
 EMAIL_HOST = env("EMAIL_HOST", default="smtp.gmail.com")
 EMAIL_USE_SSL = env.bool("EMAIL_USE_SSL", default=False)
 EMAIL_USE_TLS = not EMAIL_USE_SSL
@@ -57,9 +59,34 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 OTP_EMAIL_SENDER = EMAIL_HOST_USER
 OTP_EMAIL_TOKEN_VALIDITY = 300
 
+# SMTP connection pool (back.core.mail_backends.PooledEmailBackend)
+EMAIL_POOL_SIZE = env.int("EMAIL_POOL_SIZE", default=4)  # per process
+EMAIL_POOL_MAX_MESSAGES = env.int("EMAIL_POOL_MAX_MESSAGES", default=100)
+EMAIL_POOL_IDLE_TIMEOUT = env.int("EMAIL_POOL_IDLE_TIMEOUT", default=60)  # seconds
+EMAIL_POOL_TIMEOUT = env.int("EMAIL_POOL_TIMEOUT", default=30)  # seconds
+
 # simple-mail settings
 # https://github.com/VingtCinq/django-simple-mail
 SIMPLE_MAIL_USE_CKEDITOR = True
+SIMPLE_MAIL_TEMPLATE_CACHE_TIMEOUT = env.int(
+    "SIMPLE_MAIL_TEMPLATE_CACHE_TIMEOUT", default=300
+)  # seconds, compiled mail templates are kept per process
+
+# Mail outbox settings, mails are stored on commit and delivered by
+# `python manage.py send_outbox`
+MAIL_OUTBOX_ENABLED = env.bool("MAIL_OUTBOX_ENABLED", default=True)
+MAIL_OUTBOX_BATCH_SIZE = env.int("MAIL_OUTBOX_BATCH_SIZE", default=50)
+MAIL_OUTBOX_MAX_ATTEMPTS = env.int("MAIL_OUTBOX_MAX_ATTEMPTS", default=8)
+MAIL_OUTBOX_RETRY_DELAY = env.int("MAIL_OUTBOX_RETRY_DELAY", default=30)  # seconds
+MAIL_OUTBOX_POLL_INTERVAL = env.float("MAIL_OUTBOX_POLL_INTERVAL", default=1.0)  # seconds
+# a claimed mail is due again after this long, if its worker died while sending
+MAIL_OUTBOX_CLAIM_TIMEOUT = env.int("MAIL_OUTBOX_CLAIM_TIMEOUT", default=300)  # seconds
+MAIL_OUTBOX_KEEP_SENT_DAYS = env.int("MAIL_OUTBOX_KEEP_SENT_DAYS", default=7)
+MAIL_OUTBOX_PRUNE_INTERVAL = env.int("MAIL_OUTBOX_PRUNE_INTERVAL", default=3600)  # seconds
+
+# Side effects run after commit (back.apps.user.dispatch)
+USER_SIDE_EFFECTS_ASYNC = env.bool("USER_SIDE_EFFECTS_ASYNC", default=True)
+USER_SIDE_EFFECTS_WORKERS = env.int("USER_SIDE_EFFECTS_WORKERS", default=4)
 
 # Application definition
 # fmt: off
@@ -106,6 +133,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "back.core.db_routers.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -113,6 +141,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # last, so that its transaction only spans the view
+    "back.core.transactions.TransactionPolicyMiddleware",
 ]
 
 ROOT_URLCONF = "back.urls"
@@ -148,16 +178,73 @@ WSGI_APPLICATION = "back.wsgi.application"
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        # postgresql with connection health checks
+        "ENGINE": "back.core.db.postgresql",
         "NAME": env("DATABASE_NAME"),
         "USER": env("DATABASE_USER"),
         "PASSWORD": env("DATABASE_PASSWORD"),
         "HOST": env("DATABASE_HOST"),
         "PORT": env("DATABASE_PORT"),
-        "ATOMIC_REQUESTS": True,
+        # persistent connections, checked before being reused. Not under
+        # ASGI (USER_ASYNC_VIEWS): each request runs its queries in a new
+        # thread, so a new connection, and would leave it open until it ages
+        "CONN_MAX_AGE": env.int(
+            "DATABASE_CONN_MAX_AGE",
+            default=0 if env.bool("USER_ASYNC_VIEWS", default=False) else 60,
+        ),
+        "CONN_HEALTH_CHECKS": env.bool("DATABASE_CONN_HEALTH_CHECKS", default=True),
+        # behind a transaction pooler (pgbouncer pool_mode=transaction) a
+        # cursor can not outlive its transaction
+        "DISABLE_SERVER_SIDE_CURSORS": env.bool("DATABASE_POOLER", default=False),
     }
 }
 
+# Read replicas, "host[:port]" of each, the rest is the same as default.
+# GET requests read from them, see back.core.db_routers.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(env.list("DATABASE_REPLICA_HOSTS", default=[])):
+    host, _sep, port = replica.partition(":")
+    alias = f"replica_{index + 1}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["back.core.db_routers.ReplicaRouter"]
+
+# After a write, the client and the user read from the primary this long
+REPLICA_STICKY_SECONDS = env.int("REPLICA_STICKY_SECONDS", default=10)
+REPLICA_STICKY_COOKIE_NAME = "primary_db"
+
+# Transaction of each request, views can override it with their
+# `transaction_policy`, see back.core.transactions
+TRANSACTION_POLICY = env("TRANSACTION_POLICY", default="writes")
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# e.g. CACHE_URL=rediscache://127.0.0.1:6379/1 for a cache shared by workers
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+
+# Rendered profiles (back.apps.user.cache)
+PROFILE_CACHE_ALIAS = env("PROFILE_CACHE_ALIAS", default="default")
+PROFILE_CACHE_TIMEOUT = env.int("PROFILE_CACHE_TIMEOUT", default=60 * 60)  # seconds
+
+# Single user lookups of the authentication (back.apps.user.cache), on by
+# default with a shared CACHE_URL only: per process caches (locmem) miss the
+# invalidations of the other workers. 0 disables them
+_shared_cache = bool(env("CACHE_URL", default=""))
+USER_CACHE_TIMEOUT = env.int(
+    "USER_CACHE_TIMEOUT", default=5 * 60 if _shared_cache else 0
+)  # seconds
+USER_CACHE_MISS_TIMEOUT = env.int(
+    "USER_CACHE_MISS_TIMEOUT", default=60 if _shared_cache else 0
+)  # seconds
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -200,35 +287,95 @@ MEDIA_ROOT = str(BASE_DIR / "../media")
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
+# Carry the user fields in the access tokens and authenticate requests from
+# them, without querying the user (see back.apps.user.tokens)
+USER_TOKEN_CLAIMS = env.bool("USER_TOKEN_CLAIMS", default=False)
+
 # RestFramework settings
 # https://www.django-rest-framework.org/api-guide/settings/
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "back.apps.user.authentication.ClaimsJWTAuthentication"
+        if USER_TOKEN_CLAIMS
+        else "back.apps.user.authentication.JWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
+    "DEFAULT_RENDERER_CLASSES": (
+        "back.core.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "back.core.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
+    "DEFAULT_PAGINATION_CLASS": "back.core.pagination.EstimatedCountPagination",
     "DEFAULT_FILTER_BACKENDS": [
         "rest_framework.filters.SearchFilter",
         "rest_framework.filters.OrderingFilter",
         "django_filters.rest_framework.DjangoFilterBackend",
     ],
     "PAGE_SIZE": 10,
+    # endpoints hashing passwords or sending mails, "<scope>.<kind>" (see
+    # back.core.throttling), scopes left out are not throttled
+    "DEFAULT_THROTTLE_RATES": {
+        "login.ip": "30/min",
+        "login.username": "10/min",
+        "register.ip": "10/hour",
+        "register.email": "3/hour",
+        "password_change.ip": "10/min",
+        "password_change.username": "5/min",
+        "password_reset.ip": "10/hour",
+        "password_reset.email": "3/hour",
+    },
+    # reverse proxies in front of the app, the client IP of the throttles is
+    # taken that many hops from the end of X-Forwarded-For, with 0 it is
+    # REMOTE_ADDR (the header is set by the client otherwise)
+    "NUM_PROXIES": env.int("NUM_PROXIES", default=0),
     # "NON_FIELD_ERRORS_KEY": "general_error",
     "EXCEPTION_HANDLER": "back.core.exception_handler.default_handler",
 }
 
+# Counters of the throttles, a per process cache (locmem) multiplies the
+# rates by the number of workers
+THROTTLE_CACHE_ALIAS = env("THROTTLE_CACHE_ALIAS", default="default")
+
+# Above this many rows the paginated `count` is the planner's estimate
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = env.int(
+    "PAGINATION_COUNT_ESTIMATE_THRESHOLD", default=100000
+)
+
+# Rows fetched per round trip by the streaming users export
+USER_EXPORT_CHUNK_SIZE = env.int("USER_EXPORT_CHUNK_SIZE", default=2000)
+# Under ASGI the export is written to a temporary file first, kept in memory
+# up to this many bytes
+USER_EXPORT_SPOOL_SIZE = env.int("USER_EXPORT_SPOOL_SIZE", default=8 * 1024 * 1024)
+
+# Route the async variants of the user views (back.apps.user.async_views),
+# for ASGI serving
+USER_ASYNC_VIEWS = env.bool("USER_ASYNC_VIEWS", default=False)
+
+# Rows written per statement by the users bulk actions
+USER_BULK_CHUNK_SIZE = env.int("USER_BULK_CHUNK_SIZE", default=1000)
+# Users created per bulk create request, their passwords are hashed in it
+USER_BULK_CREATE_MAX_ROWS = env.int("USER_BULK_CREATE_MAX_ROWS", default=20)
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "DEGVABank API",
     "DESCRIPTION": "Bank for all of you",
     "VERSION": "1.0.0",
 }
 
+# Where `manage.py build_schema` writes the schema served at docs/schema/
+SCHEMA_ROOT = env("SCHEMA_ROOT", default=str(BASE_DIR / "../schema"))
+
 
 # Specifing our user
 AUTH_USER_MODEL = "user.User"  # Currently not using it
 
+AUTHENTICATION_BACKENDS = ["back.apps.user.backends.CachedModelBackend"]
+
 
 # DRF simplejwt settings
 # https://django-rest-framework-simplejwt.readthedocs.io/en/latest/settings.html
@@ -259,6 +406,27 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 }
 
+# Refresh token blacklist (back.apps.user.blacklist). The optional per
+# process filter skips the blacklist query of most refreshes, a token
+# blacklisted by another worker may pass for the filter INTERVAL
+TOKEN_BLACKLIST_FILTER = env.bool("TOKEN_BLACKLIST_FILTER", default=False)
+TOKEN_BLACKLIST_FILTER_INTERVAL = env.float(
+    "TOKEN_BLACKLIST_FILTER_INTERVAL", default=1.0
+)  # seconds
+TOKEN_BLACKLIST_FILTER_OVERLAP = 30  # seconds
+TOKEN_BLACKLIST_FILTER_CAPACITY = env.int(
+    "TOKEN_BLACKLIST_FILTER_CAPACITY", default=100_000
+)
+TOKEN_BLACKLIST_FILTER_ERROR_RATE = 0.01
+# rows deleted per transaction by `manage.py prune_tokens`
+TOKEN_PRUNE_CHUNK_SIZE = env.int("TOKEN_PRUNE_CHUNK_SIZE", default=1000)
+
+# User activity tracking (back.apps.user.activity), last_seen and
+# last_login are written in bulk instead of once per request/login
+USER_ACTIVITY_ENABLED = env.bool("USER_ACTIVITY_ENABLED", default=True)
+USER_ACTIVITY_FLUSH_INTERVAL = env.int("USER_ACTIVITY_FLUSH_INTERVAL", default=10)  # seconds
+USER_ACTIVITY_FLUSH_CHUNK_SIZE = 5000
+
 # Expect https from HTTP Server
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
@@ -20,10 +20,12 @@ from django.urls import path, include
 from django.contrib.auth.decorators import user_passes_test
 from django.views.generic.base import View
 
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularRedocView,
-    SpectacularSwaggerView,
+from back.core.db.views import DatabaseMetricsView
+from back.core.schema import (
+    PrebuiltRedocView,
+    PrebuiltSchemaVersionView,
+    PrebuiltSchemaView,
+    PrebuiltSwaggerView,
 )
 
 
@@ -34,26 +36,31 @@ def apidocs_view_permission(user):
 
 docs_urls = [
     # documentation
-    path("schema/", SpectacularAPIView.as_view(), name="schema"),
+    path("schema/", PrebuiltSchemaView.as_view(), name="schema"),
+    path(
+        "schema/<str:version>/",
+        PrebuiltSchemaVersionView.as_view(),
+        name="schema-version",
+    ),
     # optional ui:
     path(
         "",
         user_passes_test(apidocs_view_permission)(
-            SpectacularSwaggerView.as_view(url_name="schema")
+            PrebuiltSwaggerView.as_view(url_name="schema")
         ),
         name="default-docs",
     ),
     path(
         "swagger-ui/",
         user_passes_test(apidocs_view_permission)(
-            SpectacularSwaggerView.as_view(url_name="schema")
+            PrebuiltSwaggerView.as_view(url_name="schema")
         ),
         name="swagger-ui",
     ),
     path(
         "redoc/",
         user_passes_test(apidocs_view_permission)(
-            SpectacularRedocView.as_view(url_name="schema")
+            PrebuiltRedocView.as_view(url_name="schema")
         ),
         name="redoc",
     ),
@@ -73,6 +80,8 @@ urlpatterns = (
         ),
         # docs
         path("docs/", include(docs_urls)),
+        # metrics
+        path("metrics/db/", DatabaseMetricsView.as_view(), name="db-metrics"),
         # misc
         path(
             "user/password-reset/confirm/<str:uidb64>/<str:token>/",
@@ -6,9 +6,40 @@ if [ "$1" = 'back' ]; then
 	echo "Apply database migrations"
 	python manage.py migrate
 
+	# Generate the API schema once instead of on every docs request
+	echo "Build API schema"
+	python manage.py build_schema
+
 	# Start server
 	echo "Starting server"
-	gunicorn project.wsgi:application --bind 0.0.0.0:8000 --timeout 300
+	gunicorn back.wsgi:application --bind 0.0.0.0:8000 --timeout 300
+fi
+
+if [ "$1" = 'asgi' ]; then
+	# Apply database migrations
+	echo "Apply database migrations"
+	python manage.py migrate
+
+	# Generate the API schema once instead of on every docs request
+	echo "Build API schema"
+	python manage.py build_schema
+
+	# Start server, uvicorn workers serving the async user views
+	echo "Starting ASGI server"
+	export USER_ASYNC_VIEWS=true
+	exec gunicorn back.asgi:application --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000 --timeout 300
+fi
+
+if [ "$1" = 'outbox' ]; then
+	# Deliver the queued mails, run as many of these as needed
+	echo "Starting mail outbox worker"
+	exec python manage.py send_outbox
+fi
+
+if [ "$1" = 'prune' ]; then
+	# Delete the expired refresh tokens every hour
+	echo "Starting token pruner"
+	exec python manage.py prune_tokens --interval 3600
 fi
 
 exec "$@"